@@ -0,0 +1,84 @@
+// Client side of the live table feed (change_feed.py). connect opens one EventSource per
+// page; events are queued and the hidden 'table-feed-tick' button is clicked, and drain
+// (its clientside callback) hands the queued events to the 'table-feed' store as one.
+// This works without dash_clientside.set_props, which only exists from Dash 2.16. patch
+// merges the changed rows of an event into our-table's data by id, so only those rows are
+// touched. Rows with unsaved edits or deletions are left alone: the save decides what
+// happens to them.
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    change_feed: {
+        connect: function (url) {
+            if (url && !window.ziltekChangeFeed) {
+                window.ziltekChangeFeedEvents = [];
+                window.ziltekChangeFeed = new EventSource(url);
+                window.ziltekChangeFeed.onmessage = function (event) {
+                    window.ziltekChangeFeedEvents.push(JSON.parse(event.data));
+                    document.getElementById('table-feed-tick').click();
+                };
+            }
+            return window.dash_clientside.no_update;
+        },
+
+        drain: function (nClicks) {
+            // Later events win: a row changed twice keeps its last copy, a row deleted after
+            // a change (or changed after a delete) ends up as the last event had it
+            const events = window.ziltekChangeFeedEvents || [];
+            window.ziltekChangeFeedEvents = [];
+            if (!events.length) {
+                return window.dash_clientside.no_update;
+            }
+            const rows = new Map();
+            const deleted = new Set();
+            events.forEach(event => {
+                event.rows.forEach(row => {
+                    rows.set(row.id, row);
+                    deleted.delete(row.id);
+                });
+                event.deleted.forEach(id => {
+                    rows.delete(id);
+                    deleted.add(id);
+                });
+            });
+            return {rows: Array.from(rows.values()), deleted: Array.from(deleted)};
+        },
+
+        patch: function (feed, rows, changes, pageAction) {
+            if (!feed || !rows) {
+                return window.dash_clientside.no_update;
+            }
+            changes = changes || {updated: [], deleted: []};
+            const pending = new Set(changes.updated.concat(changes.deleted));
+            const deleted = new Set(feed.deleted);
+            const incoming = new Map();
+            feed.rows.forEach(row => incoming.set(row.id, row));
+
+            let patched = false;
+            const result = [];
+            rows.forEach(row => {
+                if (row.id === undefined || row.id === null || pending.has(row.id)) {
+                    result.push(row);
+                } else if (deleted.has(row.id)) {
+                    patched = true;
+                } else if (incoming.has(row.id)) {
+                    result.push(incoming.get(row.id));
+                    incoming.delete(row.id);
+                    patched = true;
+                } else {
+                    result.push(row);
+                }
+            });
+            // New rows are added when the browser holds the whole table; a custom-paged
+            // table only refreshes the rows on its page
+            if (pageAction === 'none') {
+                const known = new Set(rows.map(row => row.id));
+                incoming.forEach((row, id) => {
+                    if (!known.has(id) && !pending.has(id)) {
+                        result.push(row);
+                        patched = true;
+                    }
+                });
+            }
+            return patched ? result : window.dash_clientside.no_update;
+        }
+    }
+});
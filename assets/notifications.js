@@ -0,0 +1,15 @@
+// Save banner countdown, run in the browser. The save callback shows the banner, puts the
+// number of seconds it stays up in the 'store' store and enables the 'interval' timer; each
+// tick counts down here, and at zero the banner is cleared and the timer disabled again, so
+// an idle page sends no requests at all.
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    notifications: {
+        countdown: function (nIntervals, seconds) {
+            seconds = (seconds || 0) - 1;
+            if (seconds > 0) {
+                return [seconds, window.dash_clientside.no_update, false];
+            }
+            return [0, [], true];
+        }
+    }
+});
@@ -0,0 +1,137 @@
+// Table edits that need nothing from the server: a new column or a blank row is appended to
+// what the browser already holds, so no request is sent and the table isn't serialised.
+// contentToken keeps such edits from sending the table to the charts' cache either.
+// applySaved folds the outcome of a save (df_to_csv) into the table as it is by then, and
+// settlePending into the edited rows a custom-paged table keeps for other pages.
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    table_edit: {
+        addColumn: function (nClicks, value, columns) {
+            if (!nClicks || !columns) {
+                return window.dash_clientside.no_update;
+            }
+            return columns.concat([{name: value, id: value, renamable: true, deletable: true}]);
+        },
+
+        contentToken: function (rows, token) {
+            // Fingerprint (two 32-bit FNV-1a style hashes with different primes, as hex) of
+            // the rows that hold a value, or no_update if it is unchanged: adding a blank row
+            // or column sends nothing
+            const filled = (rows || []).filter(row => Object.keys(row).some(key =>
+                key !== 'id' && key !== 'row_version' && row[key] !== '' && row[key] !== null));
+            const text = JSON.stringify(filled);
+            let low = 0x811c9dc5;
+            let high = 0x050c5d1f;
+            for (let i = 0; i < text.length; i++) {
+                low = Math.imul(low ^ text.charCodeAt(i), 0x01000193);
+                high = Math.imul(high ^ text.charCodeAt(i), 0x5bd1e995);
+            }
+            const next = (high >>> 0).toString(16).padStart(8, '0') + (low >>> 0).toString(16).padStart(8, '0');
+            return next === token ? window.dash_clientside.no_update : next;
+        },
+
+        addRow: function (nClicks, rows, columns) {
+            if (!nClicks || !columns) {
+                return window.dash_clientside.no_update;
+            }
+            const blankRow = {};
+            columns.forEach(column => { blankRow[column.id] = ''; });
+            return (rows || []).concat([blankRow]);
+        },
+
+        applySaved: function (saved, rows, changes) {
+            // New rows get their ids in order and saved rows their new row_version; a saved
+            // row stays in changes.updated only if it was edited again while the save ran.
+            // Conflicting rows show the database's copy (or go, if it was deleted there),
+            // and ones the user deleted come back. Same rules as remaining_changes in v4.
+            // The change feed may have delivered the new rows already: those copies go, as
+            // the browser's own rows are about to get the same ids.
+            const no_update = window.dash_clientside.no_update;
+            if (!saved || !rows) {
+                return [no_update, no_update];
+            }
+            changes = changes || {updated: [], deleted: [], deleted_versions: {}};
+            const isNew = row => row.id === undefined || row.id === null;
+            const sameValues = (row, sent) => sent !== undefined && Object.keys(Object.assign({}, row, sent))
+                .every(key => key === 'id' || key === 'row_version' || row[key] === sent[key]);
+
+            const versions = saved.versions;
+            const conflicts = new Set(saved.conflicts);
+            const current = new Map();
+            saved.current.forEach(row => current.set(row.id, row));
+            const sent = new Map();
+            const sentNew = [];
+            saved.sent.forEach(row => {
+                if (isNew(row)) {
+                    sentNew.push(row);
+                } else {
+                    sent.set(row.id, row);
+                }
+            });
+
+            const updated = new Set(changes.updated);
+            const settled = new Set(saved.deleted.concat(saved.conflicts));
+            const deleted = changes.deleted.filter(id => !settled.has(id));
+            const deletedVersions = {};
+            deleted.forEach(id => {
+                deletedVersions[id] = id in versions ? versions[id] : changes.deleted_versions[id];
+            });
+
+            const result = [];
+            const insertedIds = new Set(saved.inserted);
+            let inserted = 0;
+            rows.forEach(row => {
+                if (!isNew(row) && insertedIds.has(row.id)) {
+                    return;
+                }
+                if (isNew(row)) {
+                    if (inserted < saved.inserted.length) {
+                        const id = saved.inserted[inserted];
+                        const edited = !sameValues(row, sentNew[inserted]);
+                        row = Object.assign({}, row, {id: id, row_version: versions[id]});
+                        inserted += 1;
+                        if (edited) {
+                            updated.add(id);
+                        }
+                    }
+                } else if (conflicts.has(row.id)) {
+                    updated.delete(row.id);
+                    row = current.get(row.id);
+                    current.delete(row && row.id);
+                } else if (row.id in versions) {
+                    if (sameValues(row, sent.get(row.id))) {
+                        updated.delete(row.id);
+                    }
+                    row = Object.assign({}, row, {row_version: versions[row.id]});
+                }
+                if (row) {
+                    result.push(row);
+                }
+            });
+            current.forEach((row, id) => {
+                if (changes.deleted.includes(id)) {
+                    result.push(row);
+                }
+            });
+            // Saved rows that are no longer in the browser (another page, or deleted) are done
+            const present = new Set(result.map(row => row.id));
+            Object.keys(versions).forEach(key => {
+                const id = Number(key);
+                if (!present.has(id)) {
+                    updated.delete(id);
+                }
+            });
+            settled.forEach(id => updated.delete(id));
+            return [result, {updated: Array.from(updated), deleted: deleted, deleted_versions: deletedVersions}];
+        },
+
+        settlePending: function (saved, pending) {
+            // 'custom' mode: edited rows kept for other pages are done once saved; the page
+            // shows the database's copy of them (or of a conflicting row) from now on
+            if (!saved || !pending || !pending.length) {
+                return window.dash_clientside.no_update;
+            }
+            const conflicts = new Set(saved.conflicts);
+            return pending.filter(row => !(row.id in saved.versions) && !conflicts.has(row.id));
+        }
+    }
+});
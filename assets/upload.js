@@ -0,0 +1,74 @@
+// Streams the workbook dropped on or picked in the 'upload-data' dcc.Upload to the Flask
+// upload route in slices, then hands the spooled file's reference to Dash through the
+// 'upload-ref' store. The events are caught on the way down (capture phase) and stopped
+// before React sees them, so dcc.Upload never reads the file into a base64 data URL.
+//
+// Scripts outside a callback can't set component props before Dash 2.16 (set_props), so
+// the reference is left in window.ziltekUploadResult and the hidden 'upload-done' button
+// is clicked; its clientside callback (upload.result) copies the reference into upload-ref.
+// Every app in this directory gets this script, so it only takes over when the page has
+// that button: elsewhere (v3B, jc) dcc.Upload keeps working as it always did.
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    upload: {
+        result: function (nClicks) {
+            return window.ziltekUploadResult || window.dash_clientside.no_update;
+        }
+    }
+});
+
+(function () {
+    const UPLOAD_URL = '/uploads';
+    const CHUNK_SIZE = 4 * 1024 * 1024;
+
+    async function uploadWorkbook(file) {
+        let result = null;
+        for (let offset = 0; offset < file.size || result === null; offset += CHUNK_SIZE) {
+            const params = result === null ? '' : `?upload_id=${result.upload_id}&offset=${offset}`;
+            const response = await fetch(UPLOAD_URL + params, {
+                method: 'POST',
+                headers: {'X-Filename': encodeURIComponent(file.name)},
+                body: file.slice(offset, offset + CHUNK_SIZE)
+            });
+            result = await response.json();
+            if (!response.ok) {
+                throw new Error(result.error || response.statusText);
+            }
+        }
+        return result;
+    }
+
+    function handOver(result) {
+        window.ziltekUploadResult = result;
+        document.getElementById('upload-done').click();
+    }
+
+    function startUpload(file) {
+        uploadWorkbook(file)
+            .then(handOver)
+            .catch(error => handOver({filename: file.name, error: String(error.message || error)}));
+    }
+
+    function insideUpload(target) {
+        return target instanceof Element && target.closest('#upload-data') !== null &&
+            document.getElementById('upload-done') !== null;
+    }
+
+    document.addEventListener('change', function (event) {
+        const input = event.target;
+        if (!insideUpload(input) || !input.files || !input.files.length) {
+            return;
+        }
+        event.stopPropagation();
+        startUpload(input.files[0]);
+        input.value = '';
+    }, true);
+
+    document.addEventListener('drop', function (event) {
+        if (!insideUpload(event.target) || !event.dataTransfer.files.length) {
+            return;
+        }
+        event.preventDefault();
+        event.stopPropagation();
+        startUpload(event.dataTransfer.files[0]);
+    }, true);
+})();
@@ -0,0 +1,283 @@
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import datetime
+import tempfile
+import tracemalloc
+import importlib.util
+from contextlib import redirect_stderr, redirect_stdout
+
+from openpyxl import Workbook, load_workbook
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from excel_extraction import find_values, extract_sheets, sheet_record, records_to_frame
+from excel_processing2 import ExcelFileCombiner
+
+# End-to-end throughput of the workbook extractors on synthetic mk1/mk2 Technical test
+# workbooks: find_values on an open workbook, extract_sheets (the background job path),
+# process_excel from the v4 app and ExcelFileCombiner, sequential and parallel. Reports
+# sheets/s, cells/s (cells of the generated sheet grid) and the peak Python heap
+# allocated during a run (tracemalloc, parent process only).
+# Run with:  python benchmarks/bench_extraction.py --sheets 50 200 --noise 400
+# Save a run with --save results.json and check a later one against it with
+# --baseline results.json; the exit status is 1 if any throughput drops by more than
+# --tolerance.
+
+SEARCH_STRINGS = [
+    'Client',
+    'Country',
+    'Service date',
+    'Reason for Service',
+    'RemScan Serial #',
+    'User ID',
+    'Password',
+    'Background Cap (Minimum requirement = 4500 @ Gain = 255)',
+    'Polystyrene P/S Cap (Minimum requirement = 4000 @ Gain = 255)',
+    'SNR: (1142 - 1042 cm-1) (Recommended requirement = 4500)',
+    'SNR: (2600 - 2500 cm-1) ',
+    'Centre burst intensity (Interferogram) (Minmum requirement =20,000)'
+]
+
+TWO_CELLS_AWAY_STRINGS = [
+    'Single beam spectrum (Counts: 4200-4500 / Total Counts)x100                  (Minimum requirement = 1%)',
+    'Single beam spectrum (Counts: 2600-3000 / Total Counts)x100                  (Minimum requirement = 7%)'
+]
+
+# Text that looks like the workbook's own notes but contains none of the labels
+NOISE_WORDS = ['Instrument', 'checked', 'Gain', 'spectrum', 'Counts', 'Technician', 'pass', 'fail',
+               'Comments', 'requirement', 'cm-1', 'Interferogram', 'n/a', 'OK', 'Total']
+
+TARGETS = ['find_values', 'extract_sheets', 'process_excel', 'combiner', 'combiner_parallel']
+
+
+def label_value(rng, label, index):
+    if label == 'Client':
+        return f'Client {index % 40}'
+    if label == 'Country':
+        return rng.choice(['Kuwait', 'Australia', 'Nigeria', 'Oman'])
+    if label == 'Service date':
+        day = datetime.datetime(2019, 1, 1) + datetime.timedelta(days=rng.randrange(2000))
+        # A share of the workbooks carry the date as text, as typed by hand
+        return day if rng.random() < 0.8 else day.strftime('%d/%m/%Y')
+    if label == 'Reason for Service':
+        return rng.choice(['pre delivery', 'annual service', 'repair'])
+    if label == 'RemScan Serial #':
+        return f'MY{rng.randrange(300):04d}TS01'
+    if label in ('User ID', 'Password'):
+        return 'TBA'
+    return round(rng.gauss(5000, 500), 2)
+
+
+def generate_workbook(path, sheets, rows=60, columns=12, noise=200, layout='fixed', seed=0):
+    # Write one Technical test workbook of `sheets` sheets on a rows x columns grid. Each
+    # label is written once per sheet with its value 1 (or 2) cells to the right; with
+    # layout='shuffled' every sheet gets its own label rows and label column, otherwise
+    # they sit in the same place on every sheet. `noise` filler cells (text, numbers and
+    # dates) are scattered over the cells the labels don't use. Returns the number of cells.
+    rng = random.Random(seed)
+    labels = [(label, 1) for label in SEARCH_STRINGS] + [(label, 2) for label in TWO_CELLS_AWAY_STRINGS]
+    if rows < 2 * len(labels) or columns < 4:
+        raise ValueError(f'The grid needs at least {2 * len(labels)} rows and 4 columns')
+
+    wb = Workbook()
+    wb.remove(wb.active)
+    fixed_rows = [3 + 2 * position for position in range(len(labels))]
+    for index in range(sheets):
+        ws = wb.create_sheet(f'Sheet {index + 1}')
+        if layout == 'shuffled':
+            label_rows = rng.sample(range(1, rows + 1), len(labels))
+            label_column = rng.randrange(1, columns - 2)
+        else:
+            label_rows, label_column = fixed_rows, 2
+
+        used = set()
+        for (label, offset), row in zip(labels, label_rows):
+            ws.cell(row, label_column, label)
+            ws.cell(row, label_column + offset, label_value(rng, label, index))
+            used.update((row, label_column + step) for step in range(offset + 1))
+
+        free = [(row, column) for row in range(1, rows + 1) for column in range(1, columns + 1)
+                if (row, column) not in used]
+        for row, column in rng.sample(free, min(noise, len(free))):
+            kind = rng.random()
+            if kind < 0.6:
+                value = ' '.join(rng.choices(NOISE_WORDS, k=rng.randrange(1, 6)))
+            elif kind < 0.9:
+                value = round(rng.uniform(0, 100000), 3)
+            else:
+                value = datetime.datetime(2019, 1, 1) + datetime.timedelta(days=rng.randrange(2000))
+            ws.cell(row, column, value)
+        # Pin the sheet dimensions so every sheet is read as the full grid
+        if ws.cell(rows, columns).value is None:
+            ws.cell(rows, columns, ' ')
+    wb.save(path)
+    return sheets * rows * columns
+
+
+def load_v4_app():
+    # The v4 app's file name has a space in it, so it is loaded by path. Importing it builds
+    # the Dash app and runs the schema check, so the database must be reachable.
+    spec = importlib.util.spec_from_file_location('crud_dash_v4', os.path.join(ROOT, 'crud_dash_postgresql v4.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def run_find_values(file_paths, file_types):
+    records = []
+    for file_path, file_type in zip(file_paths, file_types):
+        wb = load_workbook(file_path, read_only=True, data_only=True)
+        for sheet_name in wb.sheetnames:
+            found_values = find_values(wb[sheet_name], SEARCH_STRINGS, TWO_CELLS_AWAY_STRINGS)
+            records.append(sheet_record(found_values, file_type, sheet_name))
+        wb.close()
+    return records_to_frame(records, ['Type', 'Sheet'] + SEARCH_STRINGS + TWO_CELLS_AWAY_STRINGS)
+
+
+def run_extract_sheets(file_paths, file_types):
+    records = []
+    for file_path, file_type in zip(file_paths, file_types):
+        wb = load_workbook(file_path, read_only=True)
+        sheet_names = wb.sheetnames
+        wb.close()
+        records.extend(extract_sheets(file_path, file_type, sheet_names, SEARCH_STRINGS, TWO_CELLS_AWAY_STRINGS))
+    return records
+
+
+def run_process_excel(file_paths, file_types, v4_app):
+    return [v4_app.process_excel(file_path) for file_path in file_paths]
+
+
+def run_combiner(file_paths, file_types, output_dir, parallel=False):
+    output_file = os.path.join(output_dir, 'combine_parallel.csv' if parallel else 'combine.csv')
+    if os.path.exists(output_file):
+        os.remove(output_file)
+    combiner = ExcelFileCombiner(file_paths, file_types, output_file, SEARCH_STRINGS, TWO_CELLS_AWAY_STRINGS,
+                                 parallel=parallel)
+    combiner.combine_files()
+
+
+def measure(func, repeat):
+    # Best wall time of `repeat` runs, then one more run under tracemalloc for the peak
+    best = None
+    with open(os.devnull, 'w') as devnull, redirect_stdout(devnull), redirect_stderr(devnull):
+        for _ in range(repeat):
+            start = time.perf_counter()
+            func()
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        tracemalloc.start()
+        try:
+            func()
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return best, peak
+
+
+def check_extraction(frame, sheet_count):
+    # Every sheet must come back with every label found, or the numbers mean nothing
+    if len(frame) != sheet_count:
+        raise AssertionError(f'{len(frame)} records for {sheet_count} sheets')
+    missing = frame[SEARCH_STRINGS + TWO_CELLS_AWAY_STRINGS].isna().sum()
+    if missing.any():
+        raise AssertionError(f'Labels not found: {missing[missing > 0].to_dict()}')
+
+
+def compare(results, baseline, tolerance):
+    # Return a line per result whose sheets/s fell more than tolerance below the baseline
+    # Only runs of the same workload are compared
+    key = lambda result: (result['target'], result['sheets'], result['cells'], result['noise'], result['layout'])
+    previous = {key(result): result for result in baseline}
+    regressions = []
+    for result in results:
+        before = previous.get(key(result))
+        if before and result['sheets_per_s'] < before['sheets_per_s'] * (1 - tolerance):
+            regressions.append(f"{result['target']} @ {result['sheets']} sheets: "
+                               f"{before['sheets_per_s']:.1f} -> {result['sheets_per_s']:.1f} sheets/s")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the Technical test workbook extractors.')
+    parser.add_argument('--sheets', type=int, nargs='+', default=[50, 200],
+                        help='sheets per workbook; one run per value (default: 50 200)')
+    parser.add_argument('--rows', type=int, default=60, help='rows in every sheet (default: 60)')
+    parser.add_argument('--columns', type=int, default=12, help='columns in every sheet (default: 12)')
+    parser.add_argument('--noise', type=int, default=200, help='filler cells per sheet (default: 200)')
+    parser.add_argument('--layout', choices=['fixed', 'shuffled'], default='fixed',
+                        help='labels in the same cells on every sheet, or moved around per sheet')
+    parser.add_argument('--targets', nargs='+', choices=TARGETS, default=TARGETS)
+    parser.add_argument('--repeat', type=int, default=3, help='timed runs per target, best is kept (default: 3)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--save', help='write the results to this JSON file')
+    parser.add_argument('--baseline', help='JSON file from an earlier --save to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='allowed drop in sheets/s against the baseline (default: 0.2)')
+    args = parser.parse_args()
+
+    v4_app = None
+    if 'process_excel' in args.targets:
+        with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+            v4_app = load_v4_app()
+
+    work_dir = tempfile.mkdtemp(prefix='ziltek_bench_')
+    results = []
+    try:
+        print(f"{'target':>18} {'sheets':>7} {'time (s)':>9} {'sheets/s':>9} {'cells/s':>11} {'peak MiB':>9}")
+        for sheet_count in args.sheets:
+            file_types = ['mk1', 'mk2']
+            file_paths = [os.path.join(work_dir, f'{file_type} Technical test Master copy {sheet_count}.xlsx')
+                          for file_type in file_types]
+            cells = sum(generate_workbook(file_path, sheet_count, args.rows, args.columns, args.noise,
+                                          args.layout, args.seed + position)
+                        for position, file_path in enumerate(file_paths))
+            total_sheets = sheet_count * len(file_paths)
+            check_extraction(run_find_values(file_paths, file_types), total_sheets)
+
+            runs = {
+                'find_values': lambda: run_find_values(file_paths, file_types),
+                'extract_sheets': lambda: run_extract_sheets(file_paths, file_types),
+                'process_excel': lambda: run_process_excel(file_paths, file_types, v4_app),
+                'combiner': lambda: run_combiner(file_paths, file_types, work_dir),
+                'combiner_parallel': lambda: run_combiner(file_paths, file_types, work_dir, parallel=True),
+            }
+            for target in args.targets:
+                elapsed, peak = measure(runs[target], args.repeat)
+                result = {
+                    'target': target,
+                    'sheets': total_sheets,
+                    'cells': cells,
+                    'noise': args.noise,
+                    'layout': args.layout,
+                    'seconds': elapsed,
+                    'sheets_per_s': total_sheets / elapsed,
+                    'cells_per_s': cells / elapsed,
+                    'peak_bytes': peak,
+                }
+                results.append(result)
+                print(f"{target:>18} {total_sheets:>7} {elapsed:>9.3f} {result['sheets_per_s']:>9.1f} "
+                      f"{result['cells_per_s']:>11.0f} {peak / 2 ** 20:>9.1f}")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f'Regression: {regression}')
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
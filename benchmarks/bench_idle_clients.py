@@ -0,0 +1,227 @@
+import os
+import sys
+import json
+import time
+import socket
+import logging
+import argparse
+import threading
+import urllib.error
+import urllib.request
+import importlib.util
+from contextlib import redirect_stderr, redirect_stdout
+
+import flask
+from werkzeug.serving import make_server
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Load test of what idle browsers cost the server. Opens --clients pages of the app in a
+# real browser engine, each with its own cookies and storage (so its own session), waits
+# for the page load callbacks to settle and then counts, on the server, the
+# /_dash-update-component requests that arrive while nobody touches anything. Whatever the
+# Dash renderer sends on its own (interval ticks feeding server callbacks, say) is counted;
+# clientside callbacks cost nothing. Apps with /metrics/callbacks also get the callback time
+# the server spent.
+# --browser chromium (default) needs:  pip install playwright && playwright install chromium
+# --browser qtwebengine uses the Chromium inside Qt, offscreen:  pip install PyQt6-WebEngine
+# Run with:  python benchmarks/bench_idle_clients.py --clients 20 --seconds 20
+# Pass --app to load another app file (the old one from git, say) for a before/after; the
+# exit status is 1 if an idle client sends more than --max-rate requests/s.
+
+# True until the Dash renderer has drawn the layout, and while it waits on a callback
+LOADING_JS = ("document.querySelector('#react-entry-point *') === null || "
+              "document.querySelector('._dash-loading, [data-dash-is-loading=\"true\"]') !== null")
+# Pages get this long to finish loading before the run goes ahead anyway
+LOAD_TIMEOUT = 120
+
+
+def load_app(path):
+    spec = importlib.util.spec_from_file_location('bench_idle_app', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def count_callback_requests(flask_app):
+    # Server-side count of callback requests; registered before the first request is served
+    hits = {'count': 0}
+    lock = threading.Lock()
+
+    @flask_app.before_request
+    def count_hit():
+        if flask.request.path.endswith('/_dash-update-component'):
+            with lock:
+                hits['count'] += 1
+
+    return hits
+
+
+def start_server(flask_app):
+    # Quiet: no access log line per request
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    server = make_server('127.0.0.1', free_port(), flask_app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def fetch(url, body=None):
+    request = urllib.request.Request(url, data=None if body is None else json.dumps(body).encode(),
+                                     headers={'Content-Type': 'application/json'})
+    with urllib.request.urlopen(request, timeout=30) as response:
+        return response.status, json.loads(response.read() or 'null')
+
+
+def reset_metrics(base_url):
+    # False if the app has no metrics route (the apps before callback_metrics.py)
+    try:
+        fetch(f'{base_url}/metrics/callbacks', {})
+    except urllib.error.HTTPError as e:
+        if e.code in (404, 405):
+            return False
+        raise
+    return True
+
+
+def callback_totals(base_url):
+    _, metrics = fetch(f'{base_url}/metrics/callbacks')
+    calls = sum(stats['calls'] for stats in metrics['callbacks'].values())
+    wall_ms = sum(stats['calls'] * stats['mean_wall_ms'] for stats in metrics['callbacks'].values())
+    return calls, wall_ms
+
+
+def chromium_pages(base_url, clients):
+    # Headless Chromium through Playwright, one browser context per client. Returns
+    # wait(seconds), loading() (pages still loading) and close().
+    try:
+        from playwright.sync_api import sync_playwright
+    except ImportError:
+        sys.exit('Playwright is needed: pip install playwright && playwright install chromium')
+    playwright = sync_playwright().start()
+    browser = playwright.chromium.launch()
+    pages = []
+    for _ in range(clients):
+        page = browser.new_context().new_page()
+        page.goto(base_url, wait_until='load')
+        pages.append(page)
+
+    def loading():
+        return sum(page.evaluate(LOADING_JS) for page in pages)
+
+    def close():
+        browser.close()
+        playwright.stop()
+
+    return time.sleep, loading, close
+
+
+def qtwebengine_pages(base_url, clients):
+    # The same, in QtWebEngine: one visible (offscreen) view per client, each with its own
+    # off-the-record profile. Qt's event loop has to keep running, so waiting runs it.
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    try:
+        from PyQt6.QtCore import QEventLoop, QTimer, QUrl
+        from PyQt6.QtWebEngineCore import QWebEngineProfile
+        from PyQt6.QtWebEngineWidgets import QWebEngineView
+        from PyQt6.QtWidgets import QApplication
+    except ImportError:
+        sys.exit('PyQt6-WebEngine is needed: pip install PyQt6-WebEngine')
+    app = QApplication.instance() or QApplication(sys.argv[:1])
+
+    def wait(seconds):
+        # app is referenced here so it lives as long as the pages do
+        loop = QEventLoop(app)
+        QTimer.singleShot(int(seconds * 1000), loop.quit)
+        loop.exec()
+
+    views = []
+    for _ in range(clients):
+        view = QWebEngineView(QWebEngineProfile(app))
+        view.resize(1280, 800)
+        view.show()
+        view.load(QUrl(base_url))
+        views.append(view)
+
+    def loading():
+        results = []
+        for view in views:
+            view.page().runJavaScript(LOADING_JS, 0, results.append)
+        for _ in range(50):
+            if len(results) == len(views):
+                break
+            wait(0.1)
+        return len(views) - results.count(False)
+
+    def close():
+        for view in views:
+            view.close()
+            view.deleteLater()
+        wait(0.5)
+
+    return wait, loading, close
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure the requests idle browsers send to a Dash app.')
+    parser.add_argument('--app', default=os.path.join(ROOT, 'crud_dash_postgresql v4.py'),
+                        help='app file to load (default: the v4 app)')
+    parser.add_argument('--browser', choices=('chromium', 'qtwebengine'), default='chromium',
+                        help='browser engine to open the pages in (default: chromium, via Playwright)')
+    parser.add_argument('--clients', type=int, default=20, help='idle browser pages (default: 20)')
+    parser.add_argument('--seconds', type=float, default=20, help='how long they sit idle (default: 20)')
+    parser.add_argument('--settle', type=float, default=5,
+                        help='seconds to wait once the pages have loaded, before counting (default: 5)')
+    parser.add_argument('--max-rate', type=float, default=0.0,
+                        help='requests/s an idle client may send before the run fails (default: 0)')
+    args = parser.parse_args()
+
+    with open(os.devnull, 'w') as devnull, redirect_stdout(devnull), redirect_stderr(devnull):
+        app = load_app(args.app)
+    hits = count_callback_requests(app.server)
+    server = start_server(app.server)
+    base_url = f'http://127.0.0.1:{server.server_port}'
+
+    open_pages = qtwebengine_pages if args.browser == 'qtwebengine' else chromium_pages
+    wait, loading, close = open_pages(base_url, args.clients)
+    deadline = time.monotonic() + LOAD_TIMEOUT
+    while loading() and time.monotonic() < deadline:
+        wait(1)
+    wait(args.settle)
+    # Only what arrives while the pages sit idle is counted
+    metrics = reset_metrics(base_url)
+    start_count = hits['count']
+    start = time.perf_counter()
+    wait(args.seconds)
+    requests = hits['count'] - start_count
+    elapsed = time.perf_counter() - start
+    still_loading = loading()
+    close()
+    totals = callback_totals(base_url) if metrics else None
+    server.shutdown()
+
+    rate = requests / args.clients / elapsed
+    print(f'{os.path.basename(args.app)}: {args.clients} idle {args.browser} pages for {elapsed:.1f}s')
+    print(f'  pages still loading:     {still_loading}')
+    print(f'  page load requests:      {start_count}')
+    print(f'  callback requests:       {requests}')
+    print(f'  requests/s per client:   {rate:.3f}')
+    if totals is None:
+        print('  server callback time:    n/a (no /metrics/callbacks)')
+    else:
+        calls, wall_ms = totals
+        print(f'  server callback calls:   {calls}')
+        print(f'  server callback time:    {wall_ms:.0f} ms ({wall_ms / elapsed:.1f} ms/s)')
+    if rate > args.max_rate:
+        print(f'FAIL: idle clients send {rate:.3f} requests/s each (limit {args.max_rate:g})')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+import os
+import sys
+import time
+import datetime
+import warnings
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from excel_extraction import sheet_record, records_to_frame
+
+warnings.simplefilter("ignore", category=FutureWarning)
+
+# Compares the old "one-row temp_df + pd.concat per sheet" build against
+# accumulating plain records and creating the DataFrame once.
+# Run with:  python benchmarks/bench_records.py
+
+search_strings = ['Client', 'Country', 'Service date', 'Reason for Service', 'RemScan Serial #', 'User ID',
+                  'Password', 'Background Cap', 'Polystyrene P/S Cap', 'SNR: (1142 - 1042 cm-1)',
+                  'SNR: (2600 - 2500 cm-1) ', 'Centre burst intensity']
+two_cells_away_strings = ['Single beam spectrum 4200-4500', 'Single beam spectrum 2600-3000']
+column_names = ['Type', 'Sheet'] + search_strings + two_cells_away_strings
+
+
+def fake_found_values(i):
+    found_values = {string: float(i) for string in search_strings + two_cells_away_strings}
+    found_values['Client'] = f'Client {i}'
+    found_values['Service date'] = datetime.datetime(2023, 1, 1) + datetime.timedelta(days=i)
+    return found_values
+
+
+def build_with_concat(sheet_values):
+    df = pd.DataFrame(columns=column_names)
+    for i, found_values in enumerate(sheet_values):
+        temp_df = pd.DataFrame(sheet_record(found_values, 'mk1', f'Sheet{i}'), index=[0])
+        df = pd.concat([df, temp_df[column_names]], ignore_index=True)
+    return df
+
+
+def build_with_records(sheet_values):
+    records = [sheet_record(found_values, 'mk1', f'Sheet{i}') for i, found_values in enumerate(sheet_values)]
+    return records_to_frame(records, column_names)
+
+
+def timed(func, sheet_values, repeat=3):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(sheet_values)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+if __name__ == '__main__':
+    print(f"{'sheets':>8} {'concat (s)':>12} {'records (s)':>12} {'speedup':>8}")
+    for sheet_count in [10, 100, 1000]:
+        sheet_values = [fake_found_values(i) for i in range(sheet_count)]
+        concat_time = timed(build_with_concat, sheet_values)
+        records_time = timed(build_with_records, sheet_values)
+        print(f"{sheet_count:>8} {concat_time:>12.4f} {records_time:>12.4f} {concat_time / records_time:>7.1f}x")
@@ -0,0 +1,206 @@
+import os
+import time
+import cProfile
+import tempfile
+import threading
+import functools
+from collections import deque
+from contextlib import contextmanager
+
+from dash.exceptions import PreventUpdate
+from flask import g, jsonify, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+# Per-callback latency metrics for the Dash apps. instrument_app wraps app.callback, so every
+# callback registered after it is timed: wall time, request and response payload sizes, time
+# spent in SQL (every cursor execute on any engine, via SQLAlchemy events) and time spent
+# building DataFrames (code run under timed_frames, less any SQL run inside it). Metrics are
+# kept per worker process and served as JSON, like the pool metrics in db_pool; a POST to
+# the same route clears them.
+#
+# With ZILTEK_PROFILE_THRESHOLD_MS set, every callback runs under cProfile and the profile
+# of any call slower than the threshold is written to ZILTEK_PROFILE_DIR, for
+# `python -m pstats` or snakeviz. Profiling slows every callback down, so leave it off
+# outside of an investigation.
+PROFILE_THRESHOLD_MS = float(os.environ.get('ZILTEK_PROFILE_THRESHOLD_MS', 0))
+PROFILE_DIR = os.environ.get('ZILTEK_PROFILE_DIR', os.path.join(tempfile.gettempdir(), 'ziltek_profiles'))
+# Wall times kept per callback for the percentiles
+SAMPLE_SIZE = 500
+
+# The sample of the callback running on this thread, if any
+local = threading.local()
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def start_query(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def end_query(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info['query_start'].pop()
+    sample = getattr(local, 'sample', None)
+    if sample is not None:
+        sample['sql_ms'] += elapsed * 1000
+        sample['sql_queries'] += 1
+
+
+@contextmanager
+def timed_frames():
+    # Count the time spent in the block as DataFrame time of the running callback. Nested
+    # blocks are counted once, and SQL run inside the block is left to the SQL time.
+    sample = getattr(local, 'sample', None)
+    if sample is None or getattr(local, 'in_frames', False):
+        yield
+        return
+    local.in_frames = True
+    sql_before = sample['sql_ms']
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        local.in_frames = False
+        sample['frame_ms'] += (time.perf_counter() - start) * 1000 - (sample['sql_ms'] - sql_before)
+
+
+def frame_timer(func):
+    # Decorator form of timed_frames, for the helpers that build DataFrames
+    @functools.wraps(func)
+    def timed(*args, **kwargs):
+        with timed_frames():
+            return func(*args, **kwargs)
+    return timed
+
+
+class CallbackMetrics:
+    def __init__(self, profile_threshold_ms=PROFILE_THRESHOLD_MS, profile_dir=PROFILE_DIR):
+        self.profile_threshold_ms = profile_threshold_ms
+        self.profile_dir = profile_dir
+        self.lock = threading.Lock()
+        self.callbacks = {}
+
+    def wrap(self, func):
+        name = func.__name__
+
+        @functools.wraps(func)
+        def timed_callback(*args, **kwargs):
+            sample = {'sql_ms': 0.0, 'sql_queries': 0, 'frame_ms': 0.0, 'error': False}
+            outer = getattr(local, 'sample', None)
+            local.sample = sample
+            profiler = cProfile.Profile() if self.profile_threshold_ms else None
+            start = time.perf_counter()
+            try:
+                if profiler is not None:
+                    return profiler.runcall(func, *args, **kwargs)
+                return func(*args, **kwargs)
+            except PreventUpdate:
+                raise
+            except Exception:
+                sample['error'] = True
+                raise
+            finally:
+                sample['wall_ms'] = (time.perf_counter() - start) * 1000
+                local.sample = outer
+                if profiler is not None and sample['wall_ms'] > self.profile_threshold_ms:
+                    self.dump_profile(name, profiler, sample['wall_ms'])
+                self.finish(name, sample)
+
+        return timed_callback
+
+    def finish(self, name, sample):
+        # Inside a Dash request the response size is only known once Flask has built the
+        # response, so the sample is completed in record_payloads
+        if has_request_context():
+            sample['bytes_in'] = request.content_length or 0
+            g.setdefault('callback_samples', []).append((name, sample))
+        else:
+            self.record(name, sample)
+
+    def dump_profile(self, name, profiler, wall_ms):
+        os.makedirs(self.profile_dir, exist_ok=True)
+        path = os.path.join(self.profile_dir, f'{name}-{os.getpid()}-{time.strftime("%Y%m%d-%H%M%S")}-{wall_ms:.0f}ms.prof')
+        profiler.dump_stats(path)
+
+    def record(self, name, sample):
+        with self.lock:
+            stats = self.callbacks.setdefault(name, {
+                'calls': 0, 'errors': 0, 'wall_ms': 0.0, 'max_wall_ms': 0.0, 'sql_ms': 0.0,
+                'sql_queries': 0, 'frame_ms': 0.0, 'bytes_in': 0, 'bytes_out': 0,
+                'max_bytes_out': 0, 'recent': deque(maxlen=SAMPLE_SIZE),
+            })
+            stats['calls'] += 1
+            stats['errors'] += sample['error']
+            stats['wall_ms'] += sample['wall_ms']
+            stats['max_wall_ms'] = max(stats['max_wall_ms'], sample['wall_ms'])
+            stats['sql_ms'] += sample['sql_ms']
+            stats['sql_queries'] += sample['sql_queries']
+            stats['frame_ms'] += sample['frame_ms']
+            stats['bytes_in'] += sample.get('bytes_in', 0)
+            stats['bytes_out'] += sample.get('bytes_out', 0)
+            stats['max_bytes_out'] = max(stats['max_bytes_out'], sample.get('bytes_out', 0))
+            stats['recent'].append(sample['wall_ms'])
+
+    def metrics(self):
+        # Totals and per-call means for every callback; percentiles over the recent calls
+        callbacks = {}
+        with self.lock:
+            for name, stats in self.callbacks.items():
+                calls = stats['calls']
+                recent = sorted(stats['recent'])
+                callbacks[name] = {
+                    'calls': calls,
+                    'errors': stats['errors'],
+                    'mean_wall_ms': round(stats['wall_ms'] / calls, 3),
+                    'p50_wall_ms': round(recent[len(recent) // 2], 3),
+                    'p95_wall_ms': round(recent[min(len(recent) - 1, int(len(recent) * 0.95))], 3),
+                    'max_wall_ms': round(stats['max_wall_ms'], 3),
+                    'mean_sql_ms': round(stats['sql_ms'] / calls, 3),
+                    'mean_sql_queries': round(stats['sql_queries'] / calls, 2),
+                    'mean_frame_ms': round(stats['frame_ms'] / calls, 3),
+                    'mean_bytes_in': round(stats['bytes_in'] / calls),
+                    'mean_bytes_out': round(stats['bytes_out'] / calls),
+                    'max_bytes_out': stats['max_bytes_out'],
+                }
+        return {'pid': os.getpid(), 'profile_threshold_ms': self.profile_threshold_ms, 'callbacks': callbacks}
+
+    def reset(self):
+        with self.lock:
+            self.callbacks.clear()
+
+
+def instrument_app(app, route='/metrics/callbacks', metrics=None):
+    # Time every callback registered on app from now on and serve the metrics of this worker
+    # process at route. Call it before the callbacks are defined.
+    metrics = metrics or CallbackMetrics()
+    server = app.server
+    register = app.callback
+
+    @functools.wraps(register)
+    def callback(*args, **kwargs):
+        decorator = register(*args, **kwargs)
+
+        def wrap(func):
+            decorator(metrics.wrap(func))
+            return func
+        return wrap
+
+    app.callback = callback
+
+    @server.after_request
+    def record_payloads(response):
+        for name, sample in g.pop('callback_samples', []):
+            sample['bytes_out'] = response.calculate_content_length() or 0
+            metrics.record(name, sample)
+        return response
+
+    @server.route(route, methods=['GET', 'POST'])
+    def callback_metrics():
+        # Clearing is a POST, so crawlers and link prefetching can't trigger it
+        if request.method == 'POST':
+            metrics.reset()
+            return jsonify({'pid': os.getpid(), 'reset': True})
+        return jsonify(metrics.metrics())
+
+    return metrics
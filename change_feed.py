@@ -0,0 +1,120 @@
+import json
+import time
+import queue
+import select
+import threading
+
+import pandas as pd
+from flask import Response, stream_with_context
+
+from table_store import table_frame, table_records
+from ziltek_db import CHANGE_CHANNEL, read_rows
+
+
+# Live table updates. Saves NOTIFY the ids they changed (ziltek_db.notify_changes); one
+# listener thread per worker process LISTENs on the primary, reads the changed rows once and
+# fans them out to every browser connected to the event stream (server-sent events). The
+# browser patches just those rows into its table. Each open stream holds a server thread,
+# so run gunicorn with threaded workers (--worker-class gthread) when the feed is on.
+HEARTBEAT_SECONDS = 15
+# Events a slow browser may fall behind by before its stream is closed; EventSource then
+# reconnects on its own
+SUBSCRIBER_QUEUE_SIZE = 100
+
+
+def feed_records(df):
+    # Rows as the table holds them (dates as YYYY-MM-DD), with None for missing values so
+    # the event is plain JSON
+    return [{column: None if not isinstance(value, (list, dict)) and pd.isna(value) else value
+             for column, value in row.items()}
+            for row in table_records(table_frame(df))]
+
+
+class ChangeFeed:
+    def __init__(self, heartbeat=HEARTBEAT_SECONDS):
+        self.heartbeat = heartbeat
+        self.lock = threading.Lock()
+        self.subscribers = set()
+        self.engine = None
+        self.listener = None
+
+    def start(self, engine):
+        # The listener connects on the first subscription, not when the app is imported.
+        # engine must be the primary: notifications are not passed on to replicas, and the
+        # changed rows are read straight after the commit.
+        with self.lock:
+            if self.listener is None:
+                self.engine = engine
+                self.listener = threading.Thread(target=self.listen, daemon=True)
+                self.listener.start()
+
+    def listen(self):
+        while True:
+            connection = None
+            try:
+                # A connection of its own, taken out of the pool for good
+                connection = self.engine.raw_connection()
+                connection.detach()
+                dbapi_connection = connection.dbapi_connection
+                dbapi_connection.autocommit = True
+                with dbapi_connection.cursor() as cursor:
+                    cursor.execute(f'LISTEN {CHANGE_CHANNEL}')
+                while True:
+                    if select.select([dbapi_connection], [], [], self.heartbeat) == ([], [], []):
+                        continue
+                    dbapi_connection.poll()
+                    while dbapi_connection.notifies:
+                        self.publish(json.loads(dbapi_connection.notifies.pop(0).payload))
+            except Exception as e:
+                print(f"Change feed listener error, reconnecting: {str(e)}")
+                time.sleep(5)
+            finally:
+                if connection is not None:
+                    connection.close()
+
+    def publish(self, change):
+        with self.lock:
+            if not self.subscribers:
+                return
+        rows = feed_records(read_rows(self.engine, change['ids'])) if change['ids'] else []
+        event = json.dumps({'rows': rows, 'deleted': change['deleted']}, default=str)
+        with self.lock:
+            for subscriber in list(self.subscribers):
+                if subscriber.qsize() < SUBSCRIBER_QUEUE_SIZE:
+                    subscriber.put_nowait(event)
+                else:
+                    # Too far behind: close the stream (there is always room for the None)
+                    subscriber.put_nowait(None)
+                    self.subscribers.discard(subscriber)
+
+    def stream(self):
+        subscriber = queue.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE + 1)
+        with self.lock:
+            self.subscribers.add(subscriber)
+        try:
+            yield 'retry: 5000\n\n'
+            while True:
+                try:
+                    event = subscriber.get(timeout=self.heartbeat)
+                except queue.Empty:
+                    # Comment line, so proxies and the browser see the stream is alive
+                    yield ': keep-alive\n\n'
+                    continue
+                if event is None:
+                    return
+                yield f'data: {event}\n\n'
+        finally:
+            with self.lock:
+                self.subscribers.discard(subscriber)
+
+
+def register_change_feed(server, db, route='/changes/stream'):
+    feed = ChangeFeed()
+
+    @server.route(route)
+    def change_stream():
+        feed.start(db.engine)
+        return Response(stream_with_context(feed.stream()), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+    return feed
@@ -0,0 +1,127 @@
+import os
+
+import numpy as np
+import pandas as pd
+import plotly.graph_objects as go
+
+
+# Chart summaries computed on the server, so a figure carries bins and counts rather than
+# every test value. HISTOGRAM_BINS is NumPy's 'auto' estimator or a fixed number of bins.
+HISTOGRAM_BINS = os.environ.get('ZILTEK_HISTOGRAM_BINS', 'auto')
+# Upper bound on the bin count, which 'auto' can blow up on long-tailed columns
+MAX_BINS = 200
+# Bin count used when PostgreSQL does the binning and 'auto' is configured
+SQL_HISTOGRAM_BINS = 50
+
+
+def histogram_bins(bins=None):
+    bins = HISTOGRAM_BINS if bins is None else bins
+    return int(bins) if str(bins).isdigit() else bins
+
+
+def sql_bins():
+    # PostgreSQL bins over the column's range, so it needs a fixed count
+    bins = histogram_bins()
+    return bins if isinstance(bins, int) else SQL_HISTOGRAM_BINS
+
+
+def finite_values(series, log=False):
+    # The numeric values of a column as a float array; with log, log10 of the positive ones
+    values = pd.to_numeric(pd.Series(series), errors='coerce').to_numpy(dtype='float64', na_value=np.nan)
+    values = values[np.isfinite(values)]
+    if log:
+        values = np.log10(values[values > 0])
+    return values
+
+
+def bin_edges(values, bins=None):
+    # Shared edges for all the groups of one column, or None if there is nothing to bin
+    if len(values) == 0:
+        return None
+    edges = np.histogram_bin_edges(values, histogram_bins(bins))
+    if len(edges) - 1 > MAX_BINS:
+        edges = np.histogram_bin_edges(values, MAX_BINS)
+    return edges
+
+
+def frame_histogram(df, column, log=False, mk_types=('mk1', 'mk2')):
+    # The NumPy counterpart of ziltek_db.column_histogram: shared edges for the column and
+    # a count array per MK type, or None if the column has no values
+    df_mk_types = df['MK_Type'].astype('string').str.lower()
+    groups = {mk_type: finite_values(df.loc[df_mk_types.eq(mk_type).fillna(False), column], log)
+              for mk_type in mk_types}
+    edges = bin_edges(np.concatenate(list(groups.values())))
+    if edges is None:
+        return None
+    return edges, {mk_type: np.histogram(values, edges)[0] for mk_type, values in groups.items()}
+
+
+def histogram_bar(edges, counts, name):
+    # One histogram as a bar per bin: centre, width and count
+    edges = np.asarray(edges, dtype='float64')
+    return go.Bar(
+        x=(edges[:-1] + edges[1:]) / 2,
+        y=counts,
+        width=np.diff(edges),
+        customdata=np.column_stack([edges[:-1], edges[1:]]),
+        hovertemplate='%{customdata[0]:.4g} to %{customdata[1]:.4g}: %{y}',
+        name=name,
+        opacity=0.7,
+    )
+
+
+# Box plots are drawn from precomputed statistics; at most this many outliers per box are
+# sent, the ones furthest from the median
+BOX_MAX_OUTLIERS = int(os.environ.get('ZILTEK_BOX_MAX_OUTLIERS', 100))
+
+
+def box_stats(values, max_outliers=None):
+    # Quartiles, whiskers (the furthest values within 1.5 IQR of the box, as Plotly draws
+    # them), mean and outliers of a float array, or None if it is empty
+    max_outliers = BOX_MAX_OUTLIERS if max_outliers is None else max_outliers
+    if len(values) == 0:
+        return None
+    q1, median, q3 = np.percentile(values, [25, 50, 75])
+    low, high = q1 - 1.5 * (q3 - q1), q3 + 1.5 * (q3 - q1)
+    inside = values[(values >= low) & (values <= high)]
+    outliers = values[(values < low) | (values > high)]
+    if len(outliers) > max_outliers:
+        outliers = outliers[np.argsort(-np.abs(outliers - median), kind='stable')[:max_outliers]]
+    return {
+        'count': len(values),
+        'q1': q1,
+        'median': median,
+        'q3': q3,
+        'lowerfence': inside.min(),
+        'upperfence': inside.max(),
+        'mean': values.mean(),
+        'outliers': np.sort(outliers),
+    }
+
+
+def box_traces(stats, x, name):
+    # A precomputed go.Box plus, if there are any, its outliers as markers in the same legend group
+    traces = [go.Box(
+        x=[x],
+        q1=[stats['q1']],
+        median=[stats['median']],
+        q3=[stats['q3']],
+        lowerfence=[stats['lowerfence']],
+        upperfence=[stats['upperfence']],
+        mean=[stats['mean']],
+        boxmean=True,
+        boxpoints=False,
+        name=name,
+        legendgroup=name,
+    )]
+    if len(stats['outliers']):
+        traces.append(go.Scatter(
+            x=[x] * len(stats['outliers']),
+            y=stats['outliers'],
+            mode='markers',
+            marker=dict(size=4),
+            name=f'{name} outliers',
+            legendgroup=name,
+            showlegend=False,
+        ))
+    return traces
@@ -7,6 +7,7 @@ import plotly.graph_objects as go
 
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
+from db_pool import configure_database, register_pool_metrics
 
 
 
@@ -24,7 +25,11 @@ app.server.config["SQLALCHEMY_DATABASE_URI"] = "postgresql://postgres:PGPassword
 # app.server.config["SQLALCHEMY_DATABASE_URI"] = "postgres://kcfwfqwznavpjq:9473936daf43bff3d17c1dd8ab2c28144dfbf677\
 # 14cb30622e3017bbe55cdeac@ec2-34-197-188-147.compute-1.amazonaws.com:5432/d9eat64jon4dti"
 
+# Pool sizing, statement timeout and the URI itself can be overridden with ZILTEK_DB_* settings
+configure_database(app.server)
+
 db = SQLAlchemy(app.server)
+register_pool_metrics(app.server, db)
 
 
 class Product(db.Model):
@@ -0,0 +1,194 @@
+import os
+import re
+import stat
+import time
+import tempfile
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+
+from excel_extraction import parse_dates
+from callback_metrics import frame_timer
+
+
+# Spill files not written or read for this long are removed when a cache starts, and then
+# about once an hour, so frames left behind by earlier runs don't pile up
+SPILL_MAX_AGE = float(os.environ.get('ZILTEK_SPILL_MAX_AGE_HOURS', 24)) * 3600
+SPILL_SWEEP_INTERVAL = 3600
+# Memory each cache may hold in frames, per worker (the spill files aren't counted)
+CACHE_MAX_BYTES = int(os.environ.get('ZILTEK_CACHE_MAX_MB', 256)) * 1024 * 1024
+
+FLOAT_COLUMNS = ['Background_Cap', 'Polystyrene_PS_Cap', 'SNR_1142_1042_cm1', 'SNR_2600_2500_cm1',
+                 'Centre_burst_intensity', 'Single_beam_spectrum_4200_4500', 'Single_beam_spectrum_2600_3000']
+
+
+@frame_timer
+def build_frame(data):
+    # Parse the table rows once into the typed frame every chart reads from
+    df = pd.DataFrame(data)
+    if 'Service_date' in df.columns:
+        df['Service_date'] = parse_dates(df['Service_date'])
+        df['Year'] = df['Service_date'].dt.year
+        df['Month'] = df['Service_date'].dt.month
+    for column in FLOAT_COLUMNS:
+        if column in df.columns:
+            df[column] = pd.to_numeric(df[column], errors='coerce')
+    return df
+
+
+def private_dir(name):
+    # A directory under the system temp dir that only this user can read or write. Spill
+    # files are pickles loaded back by name, so another local user must not be able to put
+    # files there: an existing directory that isn't ours or is open to others is refused.
+    # It is shared by this user's gunicorn workers, which need each other's files.
+    uid = os.getuid() if hasattr(os, 'getuid') else None
+    path = os.path.join(tempfile.gettempdir(), name if uid is None else f'{name}-{uid}')
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    if uid is not None:
+        info = os.lstat(path)
+        if not stat.S_ISDIR(info.st_mode) or info.st_uid != uid or info.st_mode & 0o077:
+            raise RuntimeError(f'{path} must be a directory owned by uid {uid} with mode 0700')
+    return path
+
+
+def sweep_dir(path, max_age=SPILL_MAX_AGE):
+    # Remove the files in path that haven't been modified for max_age seconds
+    cutoff = time.time() - max_age
+    for entry in os.scandir(path):
+        try:
+            if entry.is_file(follow_symlinks=False) and entry.stat(follow_symlinks=False).st_mtime < cutoff:
+                os.remove(entry.path)
+        except FileNotFoundError:
+            pass
+
+
+# Server-side store of parsed table frames, keyed by browser session and table version.
+# Each session keeps its most recent versions in memory, and all sessions together stay
+# within max_bytes (least recently used first). Frames are also pickled to a spill directory
+# by a background thread, off the callback, so other gunicorn workers on the same host can
+# pick them up; a frame evicted before its turn is never written.
+class DatasetCache:
+    def __init__(self, versions_per_session=3, max_bytes=CACHE_MAX_BYTES, spill_name='ziltek_dataset_cache'):
+        self.versions_per_session = versions_per_session
+        self.max_bytes = max_bytes
+        self.spill_dir = private_dir(spill_name)
+        self.sessions = OrderedDict()
+        self.sizes = {}
+        self.total_bytes = 0
+        self.unwritten = OrderedDict()
+        self.lock = threading.Lock()
+        self.spill_ready = threading.Condition(self.lock)
+        self.swept = time.monotonic()
+        sweep_dir(self.spill_dir)
+        threading.Thread(target=self.spill_frames, daemon=True).start()
+
+    def spill_path(self, session_id, version):
+        # Both parts come from the browser, so only uuid/hex characters are allowed in the file name
+        if not re.fullmatch(r'[0-9a-f-]+', f'{session_id}{version}'):
+            raise ValueError('Invalid dataset cache key')
+        return os.path.join(self.spill_dir, f'{session_id}_{version}.pkl')
+
+    def cached(self, key):
+        session_id, version = key
+        return version in self.sessions.get(session_id, ())
+
+    def forget(self, key):
+        # Drop a cached frame (lock held); it is no longer waiting to be spilled either
+        session_id, version = key
+        versions = self.sessions[session_id]
+        del versions[version]
+        if not versions:
+            del self.sessions[session_id]
+        self.total_bytes -= self.sizes.pop(key)
+        self.unwritten.pop(key, None)
+
+    def remember(self, session_id, version, df):
+        # Make df the most recent entry and return the (session, version) keys evicted to
+        # stay within versions_per_session and max_bytes; call with the lock held. The
+        # newest frame is kept even if it alone is larger than max_bytes.
+        key = (session_id, version)
+        if self.cached(key):
+            self.forget(key)
+        versions = self.sessions.setdefault(session_id, OrderedDict())
+        self.sessions.move_to_end(session_id)
+        versions[version] = df
+        self.sizes[key] = int(df.memory_usage(index=True, deep=True).sum())
+        self.total_bytes += self.sizes[key]
+        evicted = []
+        while len(versions) > self.versions_per_session:
+            evicted.append((session_id, next(iter(versions))))
+            self.forget(evicted[-1])
+        while self.total_bytes > self.max_bytes and len(self.sizes) > 1:
+            old_session, old_versions = next(iter(self.sessions.items()))
+            old_key = (old_session, next(iter(old_versions)))
+            if old_key == key:
+                break
+            evicted.append(old_key)
+            self.forget(old_key)
+        return evicted
+
+    def remove_spilled(self, keys):
+        for session_id, version in keys:
+            try:
+                os.remove(self.spill_path(session_id, version))
+            except FileNotFoundError:
+                pass
+
+    def spill_frames(self):
+        # Background thread: pickle frames in the order they were put, through a temporary
+        # file so another worker never reads half a pickle
+        while True:
+            with self.spill_ready:
+                while not self.unwritten:
+                    self.spill_ready.wait()
+                key, df = self.unwritten.popitem(last=False)
+            path = self.spill_path(*key)
+            partial = f'{path}.{os.getpid()}.tmp'
+            try:
+                df.to_pickle(partial)
+                os.replace(partial, path)
+            except OSError as e:
+                print(f'Could not spill {os.path.basename(path)}: {e}')
+                continue
+            with self.lock:
+                evicted = not self.cached(key)
+            # Evicted while it was being written: nothing removes the file otherwise
+            if evicted:
+                self.remove_spilled([key])
+
+    def put(self, session_id, version, df):
+        key = (session_id, version)
+        self.spill_path(session_id, version)
+        with self.lock:
+            evicted = self.remember(session_id, version, df)
+            self.unwritten[key] = df
+            self.spill_ready.notify()
+            sweep = time.monotonic() - self.swept > SPILL_SWEEP_INTERVAL
+            if sweep:
+                self.swept = time.monotonic()
+
+        self.remove_spilled(evicted)
+        if sweep:
+            sweep_dir(self.spill_dir)
+
+    def get(self, session_id, version):
+        # The cached frame, or None if it was evicted; callers must not modify it
+        with self.lock:
+            versions = self.sessions.get(session_id)
+            if versions is not None and version in versions:
+                self.sessions.move_to_end(session_id)
+                versions.move_to_end(version)
+                return versions[version]
+
+        path = self.spill_path(session_id, version)
+        try:
+            df = pd.read_pickle(path)
+            # Still in use, so the sweep leaves it alone
+            os.utime(path)
+        except (FileNotFoundError, EOFError):
+            return None
+        with self.lock:
+            evicted = self.remember(session_id, version, df)
+        self.remove_spilled(evicted)
+        return df
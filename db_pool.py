@@ -0,0 +1,166 @@
+import os
+import time
+import threading
+
+from flask import g, jsonify, has_request_context, request
+from sqlalchemy import exc
+from sqlalchemy.pool import QueuePool
+
+
+# Connection pool settings for the Flask-SQLAlchemy engine. Each value is read from the
+# environment first, then from the Flask config, then falls back to the default here.
+POOL_SETTINGS = {
+    'ZILTEK_DB_POOL_SIZE': ('pool_size', int, 5),
+    'ZILTEK_DB_MAX_OVERFLOW': ('max_overflow', int, 10),
+    'ZILTEK_DB_POOL_TIMEOUT': ('pool_timeout', int, 30),
+    'ZILTEK_DB_POOL_RECYCLE': ('pool_recycle', int, 1800),
+    'ZILTEK_DB_POOL_PRE_PING': ('pool_pre_ping', lambda value: str(value).lower() in ('1', 'true', 'yes'), True),
+}
+
+
+# Bind key of the read engine in SQLALCHEMY_BINDS
+READ_BIND = 'read'
+# After a save, the browser that saved reads from the primary for this many seconds, so it
+# sees its own changes even if the replica is behind
+READ_AFTER_WRITE_SECONDS = int(os.environ.get('ZILTEK_READ_AFTER_WRITE_SECONDS', 10))
+WRITE_COOKIE = 'ziltek_last_write'
+
+
+def setting(config, name, default):
+    return os.environ.get(name, config.get(name, default))
+
+
+def configure_database(server):
+    # Fill in SQLALCHEMY_DATABASE_URI and SQLALCHEMY_ENGINE_OPTIONS before SQLAlchemy(server)
+    # is created. Options already set in SQLALCHEMY_ENGINE_OPTIONS are kept as they are.
+    config = server.config
+    config['SQLALCHEMY_DATABASE_URI'] = setting(config, 'ZILTEK_DATABASE_URI', config.get('SQLALCHEMY_DATABASE_URI'))
+
+    options = {'poolclass': InstrumentedQueuePool}
+    for name, (option, convert, default) in POOL_SETTINGS.items():
+        options[option] = convert(setting(config, name, default))
+
+    # Server-side limit for every statement, in milliseconds (0 = no limit)
+    statement_timeout = int(setting(config, 'ZILTEK_DB_STATEMENT_TIMEOUT_MS', 0))
+    if statement_timeout:
+        options['connect_args'] = {'options': f'-c statement_timeout={statement_timeout}'}
+
+    options.update(config.get('SQLALCHEMY_ENGINE_OPTIONS', {}))
+    config['SQLALCHEMY_ENGINE_OPTIONS'] = options
+
+    # Optional read engine (a replica, or a second PostgreSQL kept in sync with the primary).
+    # It gets the same pool options but a pool of its own, so reads can't use up the
+    # connections saves need.
+    read_uri = setting(config, 'ZILTEK_READ_DATABASE_URI', None)
+    if read_uri:
+        config.setdefault('SQLALCHEMY_BINDS', {}).setdefault(READ_BIND, read_uri)
+
+
+# QueuePool that counts checkouts and how often, and for how long, callers had to wait
+# because every connection (including overflow) was already checked out.
+class InstrumentedQueuePool(QueuePool):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.metrics_lock = threading.Lock()
+        self.checkouts = 0
+        self.waits = 0
+        self.wait_time = 0.0
+        self.max_wait_time = 0.0
+        self.timeouts = 0
+
+    def _do_get(self):
+        exhausted = self.checkedin() == 0 and -1 < self._max_overflow <= self.overflow()
+        start = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except exc.TimeoutError:
+            with self.metrics_lock:
+                self.timeouts += 1
+            raise
+        finally:
+            if exhausted:
+                waited = time.perf_counter() - start
+                with self.metrics_lock:
+                    self.waits += 1
+                    self.wait_time += waited
+                    self.max_wait_time = max(self.max_wait_time, waited)
+        with self.metrics_lock:
+            self.checkouts += 1
+        return connection
+
+    def metrics(self):
+        with self.metrics_lock:
+            return {
+                'pid': os.getpid(),
+                'pool_size': self.size(),
+                'max_overflow': self._max_overflow,
+                'checked_out': self.checkedout(),
+                'checked_in': self.checkedin(),
+                'overflow': max(self.overflow(), 0),
+                'checkouts': self.checkouts,
+                'waits': self.waits,
+                'wait_time_ms': round(self.wait_time * 1000, 3),
+                'max_wait_time_ms': round(self.max_wait_time * 1000, 3),
+                'timeouts': self.timeouts,
+            }
+
+
+def pool_metrics(pool):
+    if isinstance(pool, InstrumentedQueuePool):
+        return pool.metrics()
+    return {'pid': os.getpid(), 'status': pool.status()}
+
+
+def register_pool_metrics(server, db, route='/metrics/db-pool'):
+    # Expose the pool metrics of this worker process as JSON on the Flask server
+    @server.route(route)
+    def db_pool_metrics():
+        metrics = pool_metrics(db.engine.pool)
+        if READ_BIND in db.engines:
+            metrics['read'] = pool_metrics(db.engines[READ_BIND].pool)
+        return jsonify(metrics)
+
+
+# Sends reads to the read engine and writes to the primary. A save marks the response with
+# a cookie holding the time of the write; for READ_AFTER_WRITE_SECONDS after that, reads
+# made by that browser go to the primary too (read-your-writes). The cookie travels with
+# every callback request, so this holds whichever worker process serves the read.
+# Without ZILTEK_READ_DATABASE_URI both engines are the primary.
+class EngineRouter:
+    def __init__(self, db, read_after_write=READ_AFTER_WRITE_SECONDS):
+        self.db = db
+        self.read_after_write = read_after_write
+
+    def read_engine(self):
+        replica = self.db.engines.get(READ_BIND)
+        if replica is None or self.wrote_recently():
+            return self.db.engine
+        return replica
+
+    def write_engine(self):
+        if has_request_context():
+            g.ziltek_wrote = True
+        return self.db.engine
+
+    def wrote_recently(self):
+        if not has_request_context():
+            return False
+        if g.get('ziltek_wrote'):
+            return True
+        try:
+            written = float(request.cookies.get(WRITE_COOKIE, ''))
+        except ValueError:
+            return False
+        return time.time() - written < self.read_after_write
+
+    def mark_response(self, response):
+        if g.get('ziltek_wrote'):
+            response.set_cookie(WRITE_COOKIE, repr(time.time()), max_age=self.read_after_write,
+                                httponly=True, samesite='Lax')
+        return response
+
+
+def register_engine_router(server, db):
+    router = EngineRouter(db)
+    server.after_request(router.mark_response)
+    return router
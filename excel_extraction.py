@@ -0,0 +1,234 @@
+import os
+import re
+import hashlib
+import posixpath
+import zipfile
+import xml.etree.ElementTree as ET
+from functools import lru_cache
+
+import pandas as pd
+from openpyxl import load_workbook
+
+
+# Shared extraction engine for the Technical test workbooks.
+#
+# Every label is matched in a single pass over the sheet: one compiled
+# alternation of all labels is used to reject the (vast majority of) cells that
+# contain none of them, and only the cells that hit are checked label by label.
+# Neighbour values are read from the row tuple already in hand instead of a
+# random-access sheet.cell() lookup, which re-streams the XML on read-only sheets.
+
+# dtype targets for the numeric columns of the Product model (ziltektable), for callers
+# that don't have the model at hand; see model_dtypes
+NUMERIC_DTYPES = {
+    'Background_Cap': 'float64',
+    'Polystyrene_PS_Cap': 'float64',
+    'SNR_1142_1042_cm1': 'float64',
+    'SNR_2600_2500_cm1': 'float64',
+    'Centre_burst_intensity': 'float64',
+    'Single_beam_spectrum_4200_4500': 'float64',
+    'Single_beam_spectrum_2600_3000': 'float64',
+}
+
+# Text dates in the workbooks are tried against these formats in order. Override with
+# ZILTEK_SERVICE_DATE_FORMATS, a ';'-separated list of strptime formats.
+SERVICE_DATE_FORMATS = tuple(os.environ.get('ZILTEK_SERVICE_DATE_FORMATS',
+                                            '%d/%m/%Y;%Y-%m-%d;%d-%m-%Y;%d.%m.%Y').split(';'))
+
+
+class LabelIndex:
+    def __init__(self, search_strings, two_cells_away_strings):
+        self.search_strings = list(search_strings)
+        self.two_cells_away_strings = list(two_cells_away_strings)
+
+        # (label, column offset of the value) in the order the labels were given
+        self.labels = [(string, 1) for string in self.search_strings] + \
+                      [(string, 2) for string in self.two_cells_away_strings]
+        self.pattern = re.compile('|'.join(re.escape(string) for string, _ in self.labels))
+
+    def empty_values(self):
+        return {string: None for string in self.search_strings + self.two_cells_away_strings}
+
+    def match(self, text):
+        # Return the (label, offset) pairs contained in text. Labels may overlap
+        # each other, so a prefilter hit is confirmed against every label.
+        if self.pattern.search(text) is None:
+            return ()
+        return [(string, offset) for string, offset in self.labels if string in text]
+
+    def find_values(self, sheet):
+        # Walk the sheet once and collect the value found next to each label.
+        # Later matches win over earlier ones, as long as the neighbour isn't empty.
+        found_values = self.empty_values()
+        for row in sheet.iter_rows(values_only=True):
+            row_length = len(row)
+            for column, value in enumerate(row):
+                # Labels are plain text, so numbers, dates and empty cells can't match
+                if not isinstance(value, str):
+                    continue
+                for string, offset in self.match(value):
+                    if column + offset < row_length:
+                        neighbour_value = row[column + offset]
+                        if neighbour_value is not None:
+                            found_values[string] = neighbour_value
+        return found_values
+
+
+@lru_cache(maxsize=8)
+def get_label_index(search_strings, two_cells_away_strings):
+    return LabelIndex(search_strings, two_cells_away_strings)
+
+
+def find_values(sheet, search_strings, two_cells_away_strings):
+    label_index = get_label_index(tuple(search_strings), tuple(two_cells_away_strings))
+    return label_index.find_values(sheet)
+
+
+def sheet_record(found_values, record_type, sheet_name):
+    # Build one plain row for a sheet; the DataFrame is only created once all sheets are read.
+    # Values are kept as read from the cells; dates and numbers are normalised per column later.
+    record = {'Type': record_type, 'Sheet': sheet_name}
+    record.update(found_values)
+    return record
+
+
+def records_to_frame(records, column_names):
+    # Materialise all the sheet records in a single allocation
+    return pd.DataFrame.from_records(records, columns=column_names)
+
+
+def workbook_sheet_names(file_path):
+    wb = load_workbook(file_path, read_only=True)
+    try:
+        return wb.sheetnames
+    finally:
+        wb.close()
+
+
+def parse_dates(values, formats=None):
+    # Parse a column of cell values to datetime64 in one pass per format. Real dates and
+    # datetimes are kept as they are, text is tried against each format in turn (the first
+    # that fits wins) and anything else, numbers included, becomes NaT.
+    formats = SERVICE_DATE_FORMATS if formats is None else formats
+    if pd.api.types.is_datetime64_any_dtype(values):
+        return pd.Series(values).astype('datetime64[ns]').dt.normalize()
+    values = pd.Series(values, dtype=object)
+    try:
+        text = values.str.strip()
+    except AttributeError:
+        # .str refuses a column without any text in it
+        text = pd.Series(None, index=values.index, dtype=object)
+    others = values.where(text.isna() & pd.to_numeric(values, errors='coerce').isna())
+    parsed = pd.to_datetime(others, errors='coerce').astype('datetime64[ns]')
+    for date_format in formats:
+        pending = parsed.isna() & text.notna()
+        if not pending.any():
+            break
+        parsed[pending] = pd.to_datetime(text[pending], format=date_format, errors='coerce')
+    return parsed.dt.normalize()
+
+
+def normalise_dates(df, columns=('Service_date',), formats=None):
+    # Convert the date columns in place; returns, per column, how many non-empty cells
+    # matched none of the formats
+    unparsed = {}
+    for column in columns:
+        if column not in df.columns:
+            continue
+        parsed = parse_dates(df[column], formats)
+        blank = df[column].isna() | df[column].astype('string').str.strip().eq('').fillna(False)
+        unparsed[column] = int((parsed.isna() & ~blank).sum())
+        df[column] = parsed
+    return unparsed
+
+
+def model_dtypes(model):
+    # dtype targets for the numeric columns of a SQLAlchemy model, e.g. Product
+    dtypes = {}
+    for column in model.__table__.columns:
+        try:
+            python_type = column.type.python_type
+        except NotImplementedError:
+            continue
+        if python_type is float:
+            dtypes[column.name] = 'float64'
+        elif python_type is int:
+            dtypes[column.name] = 'Int64'
+    return dtypes
+
+
+def normalise_numeric(df, dtypes=NUMERIC_DTYPES):
+    # Convert the numeric columns in place, a whole column at a time. Numbers of any type and
+    # numeric text are kept; anything else becomes NaN. Returns, per column, how many
+    # non-empty cells could not be read as a number.
+    coerced = {}
+    for column, dtype in dtypes.items():
+        if column not in df.columns:
+            continue
+        values = pd.to_numeric(df[column], errors='coerce')
+        coerced[column] = int((values.isna() & df[column].notna()).sum())
+        df[column] = values.astype(dtype)
+    return coerced
+
+
+def coercion_report(coerced, label='Non-numeric values'):
+    # One line naming the columns that had cells which couldn't be converted, or '' if none
+    parts = [f'{column}: {count}' for column, count in coerced.items() if count]
+    return f'{label} left empty - ' + ', '.join(parts) if parts else ''
+
+
+def extract_sheets(file_path, record_type, sheet_names, search_strings, two_cells_away_strings, progress_queue=None):
+    # Process pool entry point: open the workbook read-only in the worker, extract
+    # the given sheets in order and report each finished sheet on the queue
+    wb = load_workbook(file_path, read_only=True, data_only=True)
+    records = []
+    try:
+        for sheet_name in sheet_names:
+            found_values = find_values(wb[sheet_name], search_strings, two_cells_away_strings)
+            records.append(sheet_record(found_values, record_type, sheet_name))
+            if progress_queue is not None:
+                progress_queue.put(1)
+    finally:
+        wb.close()
+    return records
+
+
+# XML namespaces of the xlsx parts read by workbook_fingerprint, and a shared string
+# cell (t="s") with the index of its string
+SPREADSHEET_NS = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+RELATIONSHIP_NS = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}'
+PACKAGE_RELATIONSHIP_NS = '{http://schemas.openxmlformats.org/package/2006/relationships}'
+SHARED_STRING_REF = re.compile(rb'<(?:\w+:)?c\b[^>]*\bt="s"[^>]*>\s*<(?:\w+:)?v>(\d+)<')
+
+
+def workbook_fingerprint(file_path):
+    # Content hashes for a workbook and for each of its sheets, read straight from the
+    # xlsx/xlsm zip without parsing anything with openpyxl. A sheet hash covers the
+    # sheet XML plus the shared strings it references, so text edits are caught too.
+    with open(file_path, 'rb') as f:
+        workbook_hash = hashlib.sha1(f.read()).hexdigest()
+
+    sheets = {}
+    with zipfile.ZipFile(file_path) as archive:
+        relationships = ET.fromstring(archive.read('xl/_rels/workbook.xml.rels'))
+        targets = {}
+        shared_strings = []
+        for relationship in relationships.iter(PACKAGE_RELATIONSHIP_NS + 'Relationship'):
+            target = relationship.get('Target')
+            target = target.lstrip('/') if target.startswith('/') else posixpath.normpath(posixpath.join('xl', target))
+            targets[relationship.get('Id')] = target
+            if relationship.get('Type').endswith('/sharedStrings'):
+                string_table = ET.fromstring(archive.read(target))
+                shared_strings = [''.join(text.text or '' for text in item.iter(SPREADSHEET_NS + 't'))
+                                  for item in string_table.iter(SPREADSHEET_NS + 'si')]
+
+        workbook = ET.fromstring(archive.read('xl/workbook.xml'))
+        for sheet in workbook.iter(SPREADSHEET_NS + 'sheet'):
+            sheet_xml = archive.read(targets[sheet.get(RELATIONSHIP_NS + 'id')])
+            sheet_hash = hashlib.sha1(sheet_xml)
+            for index in SHARED_STRING_REF.findall(sheet_xml):
+                sheet_hash.update(shared_strings[int(index)].encode('utf-8'))
+                sheet_hash.update(b'\0')
+            sheets[sheet.get('name')] = sheet_hash.hexdigest()
+
+    return {'hash': workbook_hash, 'sheets': sheets}
@@ -1,38 +1,36 @@
 import os
+import json
+import queue
+import argparse
 import warnings
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, wait
 import pandas as pd
 from openpyxl import load_workbook
-import datetime
 from tqdm import tqdm
-import time
+from excel_extraction import LabelIndex, sheet_record, records_to_frame, extract_sheets, workbook_fingerprint, normalise_numeric, normalise_dates, coercion_report
 
 warnings.simplefilter("ignore", category=UserWarning)
 
 
 class ExcelFileCombiner:
-    def __init__(self, file_paths, file_types, output_file, search_strings, two_cells_away_strings):
+    def __init__(self, file_paths, file_types, output_file, search_strings, two_cells_away_strings,
+                 parallel=False, max_workers=None, sheets_per_task=25, incremental=False, manifest_file=None):
         self.file_paths = file_paths
         self.file_types = file_types
         self.output_file = output_file
         self.search_strings = search_strings
         self.two_cells_away_strings = two_cells_away_strings
-        
+        self.label_index = LabelIndex(search_strings, two_cells_away_strings)
+        self.parallel = parallel
+        self.max_workers = max_workers
+        self.sheets_per_task = sheets_per_task
+        self.incremental = incremental
+        self.manifest_file = manifest_file or os.path.splitext(output_file)[0] + '_manifest.json'
+
     def find_values(self, sheet):
         # Find values in the sheet based on search strings
-        found_values = {string: None for string in search_strings + two_cells_away_strings}
-        for row in sheet.iter_rows():
-            for cell in row:
-                for string in search_strings:
-                    if string in str(cell.value):
-                        next_cell_value = sheet.cell(row=cell.row, column=cell.column + 1).value
-                        if next_cell_value is not None:
-                            found_values[string] = next_cell_value
-                for string in two_cells_away_strings:
-                    if string in str(cell.value):
-                        two_cells_away_value = sheet.cell(row=cell.row, column=cell.column + 2).value
-                        if two_cells_away_value is not None:
-                            found_values[string] = two_cells_away_value
-        return found_values
+        return self.label_index.find_values(sheet)
 
     def check_files_modified(self):
         # Check if any input files have been modified since the last output file update
@@ -50,56 +48,70 @@ class ExcelFileCombiner:
 
         return output_file_modified
 
-    def combine_files(self):
-        # Combine input files into a single CSV file
-        output_file_modified = self.check_files_modified()
-        if not output_file_modified:
-            print("No changes detected in the input files. Using the existing combined file.")
-            return
-        # Create an empty dataframe with the desired columns
-        column_names = ['Type', 'Sheet'] + search_strings + two_cells_away_strings
-       
-        df = pd.DataFrame(columns=column_names)
-
-        total_sheets = sum(len(load_workbook(file_path, read_only=True).sheetnames) for file_path in self.file_paths)
-
-        # Progress bar for file and sheet processing
-        progress_bar = tqdm(total=total_sheets, desc="Processing Files and Sheets")
-
-        for file_index, (file_path, file_type) in enumerate(zip(self.file_paths, self.file_types)):
-            wb = load_workbook(file_path, read_only=True, data_only=True)
-            sheets = wb.sheetnames
+    def extract_sequential(self, workbooks, sheet_names, progress_bar):
+        # Extract one record per sheet, workbook by workbook
+        records = []
+        for wb, file_type, names in zip(workbooks, self.file_types, sheet_names):
+            for sheet_name in names:
+                found_values = self.find_values(wb[sheet_name])
+                records.append(sheet_record(found_values, file_type, sheet_name))
+                progress_bar.update(1)
+            wb.close()
+        return records
 
-            for sheet_index, sheet_name in enumerate(sheets):
-                sheet = wb[sheet_name]
-                found_values = self.find_values(sheet)
+    def extract_parallel(self, sheet_names, progress_bar):
+        # Fan chunks of sheets from every workbook out to a process pool. Workers report
+        # each finished sheet on a queue, and the chunks are merged back in (file, sheet) order.
+        tasks = []
+        for file_path, file_type, names in zip(self.file_paths, self.file_types, sheet_names):
+            for start in range(0, len(names), self.sheets_per_task):
+                tasks.append((file_path, file_type, names[start:start + self.sheets_per_task]))
 
-                temp_data = {'Type': file_type, 'Sheet': sheet_name}
+        with multiprocessing.Manager() as manager, ProcessPoolExecutor(max_workers=self.max_workers) as executor:
+            progress_queue = manager.Queue()
+            futures = [executor.submit(extract_sheets, file_path, file_type, names,
+                                       self.search_strings, self.two_cells_away_strings, progress_queue)
+                       for file_path, file_type, names in tasks]
 
-                for string, value in found_values.items():
-                    if string == 'Service date':
-                        if value is not None:
-                            if isinstance(value, datetime.datetime):
-                               # value = value.date()#.isoformat()
-                                value = value.date().strftime('%Y-%m-%d')
-                            else:
-                                try:
-                                    value = datetime.datetime.strptime(str(value), '%d/%m/%Y').date().strftime('%Y-%m-%d')#.isoformat()
-                                except ValueError:
-                                    value = 'N/A'
-                    temp_data[string] = value
+            pending = set(futures)
+            while pending:
+                _, pending = wait(pending, timeout=0.2)
+                self.update_progress(progress_queue, progress_bar)
+            self.update_progress(progress_queue, progress_bar)
 
-                temp_df = pd.DataFrame(temp_data, index=[0])
+            records = []
+            for future in futures:
+                records.extend(future.result())
+        return records
 
-                temp_df = temp_df[column_names]
+    @staticmethod
+    def update_progress(progress_queue, progress_bar):
+        # Move the progress bar on by however many sheets the workers have finished
+        finished = 0
+        while True:
+            try:
+                finished += progress_queue.get_nowait()
+            except queue.Empty:
+                break
+        if finished:
+            progress_bar.update(finished)
 
-                df = pd.concat([df, temp_df], ignore_index=True)
+    def extract(self, sheet_names, progress_bar, workbooks=None):
+        # Extract the given sheets of every workbook (one list of names per file path),
+        # reusing the workbooks if they are already open
+        if self.parallel:
+            for wb in workbooks or []:
+                wb.close()
+            return self.extract_parallel(sheet_names, progress_bar)
+        if workbooks is None:
+            workbooks = [load_workbook(file_path, read_only=True, data_only=True) for file_path in self.file_paths]
+        return self.extract_sequential(workbooks, sheet_names, progress_bar)
 
-                progress_bar.update(1)
-                time.sleep(0.1)  # Simulate processing time
+    def finalise_frame(self, records):
+        # Build the combined dataframe from the sheet records with the database column names
+        column_names = ['Type', 'Sheet'] + self.search_strings + self.two_cells_away_strings
+        df = records_to_frame(records, column_names)
 
-        progress_bar.close()
-        
         df.columns =  ['MK_Type', 'Sheet', 'Client', 'Country', 'Service_date', 'Reason_for_Service',
                             'RemScan_Serial', 'User_ID', 'User_Password','Background_Cap',
                            'Polystyrene_PS_Cap',
@@ -107,16 +119,101 @@ class ExcelFileCombiner:
                             'SNR_2600_2500_cm1','Centre_burst_intensity',
                             'Single_beam_spectrum_4200_4500',
                             'Single_beam_spectrum_2600_3000']
-        for col in ['Background_Cap',
-                           'Polystyrene_PS_Cap',
-                            'SNR_1142_1042_cm1',
-                            'SNR_2600_2500_cm1','Centre_burst_intensity',
-                            'Single_beam_spectrum_4200_4500',
-                            'Single_beam_spectrum_2600_3000']:
-            df[col] = df[col].apply(lambda x: x if type(x) in [int, float] else None)
+        coercions = [coercion_report(normalise_numeric(df)),
+                     coercion_report(normalise_dates(df), 'Unrecognised dates')]
+        for coercion in filter(None, coercions):
+            print(coercion)
+        return df
+
+    def load_manifest(self):
+        with open(self.manifest_file) as f:
+            return json.load(f)
+
+    def save_manifest(self, fingerprints):
+        with open(self.manifest_file, 'w') as f:
+            json.dump(fingerprints, f, indent=2)
+
+    def combine_files(self):
+        # Combine input files into a single CSV file
+        output_file_modified = self.check_files_modified()
+        if not output_file_modified:
+            print("No changes detected in the input files. Using the existing combined file.")
+            return
+
+        if self.incremental and os.path.exists(self.output_file) and os.path.exists(self.manifest_file):
+            self.update_files()
+            return
+
+        if self.incremental:
+            fingerprints = {file_path: workbook_fingerprint(file_path) for file_path in self.file_paths}
+
+        # Open every workbook once up front; the sheet names also give the progress bar total
+        workbooks = [load_workbook(file_path, read_only=True, data_only=True) for file_path in self.file_paths]
+        sheet_names = [wb.sheetnames for wb in workbooks]
+
+        # Progress bar for file and sheet processing
+        progress_bar = tqdm(total=sum(len(names) for names in sheet_names), desc="Processing Files and Sheets")
+        records = self.extract(sheet_names, progress_bar, workbooks)
+        progress_bar.close()
+
+        df = self.finalise_frame(records)
         # Save the dataframe to a CSV file
         df.to_csv(self.output_file, index=False)
-        
+
+        if self.incremental:
+            self.save_manifest(fingerprints)
+
+    def update_files(self):
+        # Re-extract only the sheets whose content hash differs from the manifest and
+        # patch them into the existing combined file
+        manifest = self.load_manifest()
+        fingerprints = {file_path: workbook_fingerprint(file_path) for file_path in self.file_paths}
+
+        sheet_names = []
+        for file_path in self.file_paths:
+            previous = manifest.get(file_path, {})
+            current = fingerprints[file_path]
+            if previous.get('hash') == current['hash']:
+                sheet_names.append([])
+                continue
+            previous_sheets = previous.get('sheets', {})
+            sheet_names.append([name for name, sheet_hash in current['sheets'].items()
+                                if previous_sheets.get(name) != sheet_hash])
+
+        total_sheets = sum(len(names) for names in sheet_names)
+        print(f"{total_sheets} changed sheet(s) to re-extract.")
+        same_sheets = all(set(fingerprints[file_path]['sheets']) == set(manifest.get(file_path, {}).get('sheets', {}))
+                          for file_path in self.file_paths)
+        if total_sheets == 0 and same_sheets:
+            # Saved without changing any sheet: the combined file is current, and touching it
+            # keeps the next run from hashing the workbooks again
+            self.save_manifest(fingerprints)
+            os.utime(self.output_file)
+            return
+
+        existing = pd.read_csv(self.output_file, dtype={'MK_Type': str, 'Sheet': str})
+        normalise_dates(existing, formats=['%Y-%m-%d'])
+        frames = [existing]
+        # Only removed sheets: there is nothing to extract, just rows to drop below
+        if total_sheets:
+            progress_bar = tqdm(total=total_sheets, desc="Processing Changed Sheets")
+            records = self.extract(sheet_names, progress_bar)
+            progress_bar.close()
+            frames.append(self.finalise_frame(records))
+        combined = pd.concat(frames, ignore_index=True)
+        combined = combined.drop_duplicates(subset=['MK_Type', 'Sheet'], keep='last')
+
+        # Keep the rows in (file, sheet) order and drop any sheets that no longer exist
+        order = {}
+        for file_path, file_type in zip(self.file_paths, self.file_types):
+            for sheet_name in fingerprints[file_path]['sheets']:
+                order[(file_type, sheet_name)] = len(order)
+        positions = pd.Series([order.get(key) for key in zip(combined['MK_Type'], combined['Sheet'])],
+                              index=combined.index, dtype='float64')
+        combined = combined[positions.notna()].iloc[positions.dropna().argsort()]
+
+        combined.to_csv(self.output_file, index=False)
+        self.save_manifest(fingerprints)
 
 
 def check_valid_path(path):
@@ -124,44 +221,53 @@ def check_valid_path(path):
         raise ImportError('Invalid path. Check and try again.')
 
 
-# Get the directory of the main Python file
-directory = input('Enter a directory for the Master Instrument sheets.')
-check_valid_path(directory)
-print('Reading file from :', directory)
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Combine the Master Instrument workbooks into one CSV file.')
+    parser.add_argument('--parallel', action='store_true',
+                        help='extract the sheets in a pool of worker processes')
+    parser.add_argument('--incremental', action='store_true',
+                        help='re-extract only the sheets changed since the last run (kept in a manifest file)')
+    args = parser.parse_args()
+
+    # Get the directory of the main Python file
+    directory = input('Enter a directory for the Master Instrument sheets.')
+    check_valid_path(directory)
+    print('Reading file from :', directory)
 
-# os.path.dirname(os.path.abspath(__file__))  # Current folder
+    # os.path.dirname(os.path.abspath(__file__))  # Current folder
 
-# Define the file paths and types
-file_paths = [
-    os.path.join(directory, 'mk1 Technical test Master copy.xlsm'),
-    os.path.join(directory, 'mk2 Technical test Master copy.xlsx')
-]
-file_types = ['mk1', 'mk2']
+    # Define the file paths and types
+    file_paths = [
+        os.path.join(directory, 'mk1 Technical test Master copy.xlsm'),
+        os.path.join(directory, 'mk2 Technical test Master copy.xlsx')
+    ]
+    file_types = ['mk1', 'mk2']
 
-# Define the specific strings you're looking for
-search_strings = ['Client',
-                  'Country',
-                  'Service date',
-                  'Reason for Service',
-                  'RemScan Serial #',
-                  'User ID',
-                  'Password',
-                  'Background Cap (Minimum requirement = 4500 @ Gain = 255)',
-                  'Polystyrene P/S Cap (Minimum requirement = 4000 @ Gain = 255)',
-                  'SNR: (1142 - 1042 cm-1) (Recommended requirement = 4500)',
-                  'SNR: (2600 - 2500 cm-1) ',
-                  'Centre burst intensity (Interferogram) (Minmum requirement =20,000)']
+    # Define the specific strings you're looking for
+    search_strings = ['Client',
+                      'Country',
+                      'Service date',
+                      'Reason for Service',
+                      'RemScan Serial #',
+                      'User ID',
+                      'Password',
+                      'Background Cap (Minimum requirement = 4500 @ Gain = 255)',
+                      'Polystyrene P/S Cap (Minimum requirement = 4000 @ Gain = 255)',
+                      'SNR: (1142 - 1042 cm-1) (Recommended requirement = 4500)',
+                      'SNR: (2600 - 2500 cm-1) ',
+                      'Centre burst intensity (Interferogram) (Minmum requirement =20,000)']
 
-two_cells_away_strings = [
-    'Single beam spectrum (Counts: 4200-4500 / Total Counts)x100                  (Minimum requirement =1%)',
-    'Single beam spectrum (Counts: 2600-3000 / Total Counts)x100                  (Minimum requirement = 7%)']
+    two_cells_away_strings = [
+        'Single beam spectrum (Counts: 4200-4500 / Total Counts)x100                  (Minimum requirement =1%)',
+        'Single beam spectrum (Counts: 2600-3000 / Total Counts)x100                  (Minimum requirement = 7%)']
 
-# Construct the output file path
-output_file = os.path.join(directory, 'combine.csv')
+    # Construct the output file path
+    output_file = os.path.join(directory, 'combine.csv')
 
-# Create an instance of the ExcelFileCombiner class
-combiner = ExcelFileCombiner(file_paths, file_types, output_file, search_strings, two_cells_away_strings)
+    # Create an instance of the ExcelFileCombiner class
+    combiner = ExcelFileCombiner(file_paths, file_types, output_file, search_strings, two_cells_away_strings,
+                                 parallel=args.parallel, incremental=args.incremental)
 
 
-# Call the combine_files method
-combiner.combine_files()
+    # Call the combine_files method
+    combiner.combine_files()
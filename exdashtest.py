@@ -1,14 +1,11 @@
-import os
-import datetime
-import pandas as pd
 import dash
-from dash import dcc, html, Input, Output, State
+from dash import dcc, html, Input, Output, ClientsideFunction
 from dash.exceptions import PreventUpdate
 from openpyxl import load_workbook
+from excel_extraction import find_values, sheet_record, records_to_frame, normalise_numeric, normalise_dates, coercion_report
+from upload_spool import register_upload_endpoint, spool_path, discard_upload
 import warnings
 from tqdm import tqdm
-import io
-import base64
 import dash_table
 import numpy as np
 
@@ -16,8 +13,14 @@ import numpy as np
 warnings.simplefilter("ignore", category=UserWarning)
 
 app = dash.Dash(__name__)
+register_upload_endpoint(app.server)
 
 app.layout = html.Div([
+    # assets/upload.js takes over the file dropped on or picked in upload-data, streams it
+    # to the /uploads route and puts the spooled file's reference in the upload-ref store
+    # (by clicking the hidden upload-done button)
+    dcc.Store(id='upload-ref'),
+    html.Button(id='upload-done', n_clicks=0, style={'display': 'none'}),
     dcc.Upload(
         id='upload-data',
         children=html.Div([
@@ -34,6 +37,7 @@ app.layout = html.Div([
             'textAlign': 'center',
             'margin': '10px'
         },
+        accept='.xlsx,.xlsm',
         multiple=False
     ),
     html.Div(id='output-data-upload'),
@@ -62,32 +66,16 @@ def process_excel(file_path):
         'Single beam spectrum (Counts: 2600-3000 / Total Counts)x100                  (Minimum requirement = 7%)'
     ]
 
-    df = pd.DataFrame(columns= ['Type', 'Sheet'] +search_strings + two_cells_away_strings)
-
     wb = load_workbook(file_path, read_only=True, data_only=True)
     sheets = wb.sheetnames
 
+    records = []
     for sheet_name in sheets:
         sheet = wb[sheet_name]
         found_values = find_values(sheet, search_strings, two_cells_away_strings)
+        records.append(sheet_record(found_values, np.NaN, np.NaN))
 
-        temp_data = {'Type': np.NaN, 'Sheet': np.NaN}
-
-        for string, value in found_values.items():
-            if string == 'Service date':
-                if value is not None:
-                    if isinstance(value, datetime.datetime):
-                        value = value.date().strftime('%Y-%m-%d')
-                    else:
-                        try:
-                            value = datetime.datetime.strptime(str(value), '%d/%m/%Y').date().strftime('%Y-%m-%d')
-                        except ValueError:
-                            value = 'N/A'
-            temp_data[string] = value
-
-        temp_df = pd.DataFrame(temp_data, index=[0])
-
-        df = pd.concat([df, temp_df], ignore_index=True)
+    df = records_to_frame(records, ['Type', 'Sheet'] + search_strings + two_cells_away_strings)
 
     df.columns = [
         'MK_Type', 'Sheet', 'Client', 'Country', 'Service_date', 'Reason_for_Service', 'RemScan_Serial', 'User_ID', 'User_Password',
@@ -95,54 +83,43 @@ def process_excel(file_path):
         'Single_beam_spectrum_4200_4500', 'Single_beam_spectrum_2600_3000'
     ]
 
-    for col in [
-        'Background_Cap', 'Polystyrene_PS_Cap', 'SNR_1142_1042_cm1', 'SNR_2600_2500_cm1', 'Centre_burst_intensity',
-        'Single_beam_spectrum_4200_4500', 'Single_beam_spectrum_2600_3000'
-    ]:
-        df[col] = df[col].apply(lambda x: x if type(x) in [int, float] else None)
+    coercions = [coercion_report(normalise_numeric(df)),
+                 coercion_report(normalise_dates(df), 'Unrecognised dates')]
+    for coercion in filter(None, coercions):
+        print(coercion)
 
     return df
 
-def find_values(sheet, search_strings, two_cells_away_strings):
-    found_values = {string: None for string in search_strings + two_cells_away_strings}
-    for row in sheet.iter_rows():
-        for cell in row:
-            for string in search_strings:
-                if string in str(cell.value):
-                    next_cell_value = sheet.cell(row=cell.row, column=cell.column + 1).value
-                    if next_cell_value is not None:
-                        found_values[string] = next_cell_value
-            for string in two_cells_away_strings:
-                if string in str(cell.value):
-                    two_cells_away_value = sheet.cell(row=cell.row, column=cell.column + 2).value
-                    if two_cells_away_value is not None:
-                        found_values[string] = two_cells_away_value
-    return found_values
+# upload.js hands the spooled file's reference over through the upload-done button
+app.clientside_callback(
+    ClientsideFunction(namespace='upload', function_name='result'),
+    Output('upload-ref', 'data'),
+    Input('upload-done', 'n_clicks'),
+    prevent_initial_call=True)
+
 
 @app.callback(
     Output('output-data-upload', 'children'),
     Output('loading-output', 'children'),
     Output('table-container', 'children'),  # New output for the table
-    Input('upload-data', 'contents'),
-    State('upload-data', 'filename'),
-    State('upload-data', 'last_modified')
+    Input('upload-ref', 'data')
 )
-def update_output(contents, filename, last_modified):
+def update_output(upload):
     try:
-        if contents is None:
+        if upload is None:
             raise PreventUpdate
-
-        directory = 'uploads'
-        os.makedirs(directory, exist_ok=True)
-        file_path = os.path.join(directory, filename)
-
-        # Decode the base64 encoded content
-        content_decoded = base64.b64decode(contents.split(",")[1])
-
-        with open(file_path, 'wb') as f:
-            f.write(content_decoded)
-
-        df = process_excel(file_path)
+        if 'error' in upload:
+            raise ValueError(upload['error'])
+
+        # The upload route has already streamed the workbook into uploads/
+        filename = upload['filename']
+        file_path = spool_path(upload['upload_id'])
+
+        try:
+            df = process_excel(file_path)
+        finally:
+            # The rows are extracted (or the workbook is unreadable); the spool file is done
+            discard_upload(upload['upload_id'])
         cleaned_csv_path = file_path.replace('.xlsx', '_cleaned.csv')
         df.to_csv(cleaned_csv_path, index=False)
 
@@ -151,7 +128,7 @@ def update_output(contents, filename, last_modified):
             dash_table.DataTable(
                 id='datatable',
                 columns=[{'name': col, 'id': col} for col in df.columns],
-                data=df.to_dict('records'),
+                data=df.assign(Service_date=df['Service_date'].dt.strftime('%Y-%m-%d')).to_dict('records'),
                 page_size=10  # Adjust as needed
             )
         ])
@@ -0,0 +1,142 @@
+import os
+import re
+import json
+import uuid
+import pickle
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from excel_extraction import extract_sheets, workbook_sheet_names
+from dataset_cache import private_dir, sweep_dir
+
+
+# Background workbook extraction. submit() returns a job id straight away; a runner thread
+# fans chunks of sheets out to a process pool and records progress in a small JSON status
+# file. The status and the finished records live in a job directory on local disk, so a
+# poll that lands on another gunicorn worker of the same host still sees the job. Records
+# are pickled, so the directory is private to this user (see dataset_cache.private_dir);
+# files of jobs nobody collected are swept when the app starts.
+class ExtractionJobs:
+    def __init__(self, max_workers=None, sheets_per_task=10, job_name='ziltek_extraction_jobs'):
+        self.max_workers = max_workers
+        self.sheets_per_task = sheets_per_task
+        self.job_dir = private_dir(job_name)
+        self.executor = None
+        self.lock = threading.Lock()
+        sweep_dir(self.job_dir)
+
+    def job_path(self, job_id, suffix):
+        # The id comes back from the browser, so it must look exactly like one we handed out
+        if not isinstance(job_id, str) or not re.fullmatch(r'[0-9a-f]{32}', job_id):
+            raise ValueError('Invalid job id')
+        return os.path.join(self.job_dir, f'{job_id}{suffix}')
+
+    def get_executor(self):
+        with self.lock:
+            if self.executor is None:
+                self.executor = ProcessPoolExecutor(max_workers=self.max_workers)
+            return self.executor
+
+    def reset_executor(self, executor):
+        # A pool with a dead worker process fails every later task; the next job gets a new one
+        with self.lock:
+            if self.executor is executor:
+                self.executor = None
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def write_status(self, job_id, **status):
+        # Write then rename, so readers never see a half-written file. The pid of the process
+        # running the job lets status() tell a job in progress from one whose process died.
+        status['pid'] = os.getpid()
+        path = self.job_path(job_id, '.json')
+        with open(path + '.tmp', 'w') as f:
+            json.dump(status, f)
+        os.replace(path + '.tmp', path)
+
+    def submit(self, file_path, record_type, search_strings, two_cells_away_strings, on_finish=None):
+        job_id = uuid.uuid4().hex
+        self.write_status(job_id, state='queued', done=0, total=None)
+        runner = threading.Thread(target=self.run, daemon=True,
+                                  args=(job_id, file_path, record_type, search_strings,
+                                        two_cells_away_strings, on_finish))
+        runner.start()
+        return job_id
+
+    def run(self, job_id, file_path, record_type, search_strings, two_cells_away_strings, on_finish):
+        executor = None
+        try:
+            executor = self.get_executor()
+            sheet_names = executor.submit(workbook_sheet_names, file_path).result()
+            total = len(sheet_names)
+            self.write_status(job_id, state='running', done=0, total=total)
+
+            futures = [executor.submit(extract_sheets, file_path, record_type,
+                                       sheet_names[start:start + self.sheets_per_task],
+                                       search_strings, two_cells_away_strings)
+                       for start in range(0, total, self.sheets_per_task)]
+
+            # Chunks finish in any order, but the records are kept in sheet order
+            records = []
+            for future in futures:
+                records.extend(future.result())
+                self.write_status(job_id, state='running', done=len(records), total=total)
+
+            with open(self.job_path(job_id, '.pkl'), 'wb') as f:
+                pickle.dump(records, f)
+            self.write_status(job_id, state='done', done=total, total=total)
+        except Exception as e:
+            print(f"Error in extraction job {job_id}: {str(e)}")
+            if isinstance(e, BrokenProcessPool):
+                self.reset_executor(executor)
+            self.write_status(job_id, state='error', error=str(e))
+        finally:
+            if on_finish is not None:
+                on_finish()
+
+    def status(self, job_id):
+        try:
+            with open(self.job_path(job_id, '.json')) as f:
+                status = json.load(f)
+        except FileNotFoundError:
+            return {'state': 'missing'}
+        if status['state'] in ('queued', 'running') and not process_alive(status.get('pid')):
+            # The worker process running the job exited (restart, crash) before finishing it
+            status = {'state': 'error', 'error': 'The extraction was interrupted'}
+        return status
+
+    def pop_records(self, job_id):
+        # Hand over the records of a finished job once and remove its files. The records file
+        # is claimed with an atomic rename, so of two overlapping polls only one gets the
+        # records; the other (and any later one) gets None.
+        path = self.job_path(job_id, '.pkl')
+        claimed = f'{path}.{uuid.uuid4().hex}'
+        try:
+            os.rename(path, claimed)
+        except FileNotFoundError:
+            return None
+        try:
+            with open(claimed, 'rb') as f:
+                return pickle.load(f)
+        finally:
+            os.remove(claimed)
+            self.discard(job_id)
+
+    def discard(self, job_id):
+        for suffix in ('.pkl', '.json'):
+            try:
+                os.remove(self.job_path(job_id, suffix))
+            except FileNotFoundError:
+                pass
+
+
+def process_alive(pid):
+    if pid is None:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
@@ -1,5 +1,5 @@
 import dash
-from dash.dependencies import Input, Output, State
+from dash.dependencies import Input, Output, State, ClientsideFunction
 import dash_table
 import dash_core_components as dcc
 import dash_html_components as html
@@ -7,8 +7,11 @@ import dash_html_components as html
 import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
+from sqlalchemy import select
 
 from flask_sqlalchemy import SQLAlchemy
+from db_pool import configure_database, register_pool_metrics, register_engine_router
+from callback_metrics import instrument_app, timed_frames
 from flask import Flask
 
 # app requires "pip install psycopg2" as well
@@ -24,7 +27,16 @@ app.server.config["SQLALCHEMY_DATABASE_URI"] = "postgresql://postgres:PGPassword
 # app.server.config["SQLALCHEMY_DATABASE_URI"] = "postgres://kcfwfqwznavpjq:9473936daf43bff3d17c1dd8ab2c28144dfbf677\
 # 14cb30622e3017bbe55cdeac@ec2-34-197-188-147.compute-1.amazonaws.com:5432/d9eat64jon4dti"
 
+# Pool sizing, statement timeout and the URI itself can be overridden with ZILTEK_DB_* settings
+configure_database(app.server)
+
 db = SQLAlchemy(app.server)
+register_pool_metrics(app.server, db)
+# Reads go to ZILTEK_READ_DATABASE_URI when it is set, saves (and reads right after them) to the primary
+engines = register_engine_router(app.server, db)
+
+# Wall time, payload sizes, SQL and DataFrame time of every callback below, at /metrics/callbacks
+instrument_app(app)
 
 
 class Product(db.Model):
@@ -64,7 +76,8 @@ app.layout = html.Div([
     # Create notification when saving to excel
     html.Div(id='placeholder', children=[]),
     dcc.Store(id="store", data=0),
-    dcc.Interval(id='interval', interval=1000),
+    # Ticks only while the save banner is up; the countdown runs in the browser
+    dcc.Interval(id='interval', interval=1000, disabled=True),
 
     dcc.Graph(id='my_graph')
 
@@ -77,7 +90,8 @@ app.layout = html.Div([
 @app.callback(Output('postgres_datatable', 'children'),
               [Input('interval_pg', 'n_intervals')])
 def populate_datatable(n_intervals):
-    df = pd.read_sql_table('productlist', con=db.engine)
+    with timed_frames():
+        df = pd.read_sql_table('productlist', con=engines.read_engine())
     return [
         dash_table.DataTable(
             id='our-table',
@@ -112,31 +126,22 @@ def populate_datatable(n_intervals):
     ]
 
 
-@app.callback(
+# Adding a column or a blank row only appends to what the browser holds (assets/table_edit.js)
+app.clientside_callback(
+    ClientsideFunction(namespace='table_edit', function_name='addColumn'),
     Output('our-table', 'columns'),
     [Input('adding-columns-button', 'n_clicks')],
     [State('adding-rows-name', 'value'),
      State('our-table', 'columns')],
     prevent_initial_call=True)
-def add_columns(n_clicks, value, existing_columns):
-    if n_clicks > 0:
-        existing_columns.append({
-            'name': value, 'id': value,
-            'renamable': True, 'deletable': True
-        })
-    return existing_columns
 
-
-@app.callback(
+app.clientside_callback(
+    ClientsideFunction(namespace='table_edit', function_name='addRow'),
     Output('our-table', 'data'),
     [Input('editing-rows-button', 'n_clicks')],
     [State('our-table', 'data'),
      State('our-table', 'columns')],
     prevent_initial_call=True)
-def add_row(n_clicks, rows, columns):
-    if n_clicks > 0:
-        rows.append({c['id']: '' for c in columns})
-    return rows
 
 
 @app.callback(
@@ -147,7 +152,8 @@ def display_graph(data):
     # df_fig = pd.DataFrame(data)
     # fig = px.bar(df_fig, x='Phone', y='Sales')
 
-    pg_filtered = db.session.query(Product.Phone, Product.Sales)
+    with engines.read_engine().connect() as conn:
+        pg_filtered = conn.execute(select(Product.Phone, Product.Sales)).all()
     phone_c = [x.Phone for x in pg_filtered]
     sales_c = [x.Sales for x in pg_filtered]
     fig = go.Figure([go.Bar(x=phone_c, y=sales_c)])
@@ -157,32 +163,30 @@ def display_graph(data):
 
 @app.callback(
     [Output('placeholder', 'children'),
-     Output("store", "data")],
-    [Input('save_to_postgres', 'n_clicks'),
-     Input("interval", "n_intervals")],
-    [State('our-table', 'data'),
-     State('store', 'data')],
+     Output("store", "data"),
+     Output('interval', 'disabled')],
+    [Input('save_to_postgres', 'n_clicks')],
+    [State('our-table', 'data')],
     prevent_initial_call=True)
-def df_to_csv(n_clicks, n_intervals, dataset, s):
+def df_to_csv(n_clicks, dataset):
+    # The banner stays up for `s` seconds, counted down in the browser (notifications.countdown)
     output = html.Plaintext("The data has been saved to your PostgreSQL database.",
                             style={'color': 'green', 'font-weight': 'bold', 'font-size': 'large'})
-    no_output = html.Plaintext("", style={'margin': "0px"})
+    s = 6
+    with timed_frames():
+        pg = pd.DataFrame(dataset)
+    pg.to_sql("productlist", con=engines.write_engine(), if_exists='replace', index=False)
+    return output, s, False
 
-    input_triggered = dash.callback_context.triggered[0]["prop_id"].split(".")[0]
 
-    if input_triggered == "save_to_postgres":
-        s = 6
-        pg = pd.DataFrame(dataset)
-        pg.to_sql("productlist", con=db.engine, if_exists='replace', index=False)
-        return output, s
-    elif input_triggered == 'interval' and s > 0:
-        s = s - 1
-        if s > 0:
-            return output, s
-        else:
-            return no_output, s
-    elif s == 0:
-        return no_output, s
+app.clientside_callback(
+    ClientsideFunction(namespace='notifications', function_name='countdown'),
+    [Output('store', 'data', allow_duplicate=True),
+     Output('placeholder', 'children', allow_duplicate=True),
+     Output('interval', 'disabled', allow_duplicate=True)],
+    [Input('interval', 'n_intervals')],
+    [State('store', 'data')],
+    prevent_initial_call=True)
 
 
 if __name__ == '__main__':
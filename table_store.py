@@ -0,0 +1,262 @@
+import json
+import uuid
+import operator
+
+import pandas as pd
+
+from callback_metrics import frame_timer
+from dataset_cache import DatasetCache, build_frame
+from excel_extraction import parse_dates
+from ziltek_db import ROW_ID, ROW_VERSION, parse_filter
+
+
+# Server-side home of the editable table for the 'server' transport. Each browser session's
+# working copy (saved rows plus unsaved edits) is kept as a pandas frame, i.e. one NumPy
+# array per column, and pickled to the spill directory in that binary form. The browser
+# only holds a version token and the page on screen; every page row carries its frame
+# label in ROW_KEY so edits can be applied back to the right row.
+ROW_KEY = '_row'
+
+COMPARISONS = {'=': operator.eq, '!=': operator.ne, '<': operator.lt,
+               '<=': operator.le, '>': operator.gt, '>=': operator.ge}
+
+
+class TableStore:
+    def __init__(self, chart_cache, spill_name='ziltek_table_store'):
+        # Table frames are kept in their own cache; the typed frames the charts read are
+        # put in chart_cache under the same version, as cache_table_data does
+        self.frames = DatasetCache(spill_name=spill_name)
+        self.chart_cache = chart_cache
+
+    def publish(self, session_id, df):
+        # Store a new version of the session's table and return its token
+        version = uuid.uuid4().hex
+        self.frames.put(session_id, version, df)
+        self.chart_cache.put(session_id, version, build_frame(df))
+        return version
+
+    def get(self, session_id, version):
+        if version is None:
+            return None
+        return self.frames.get(session_id, version)
+
+
+@frame_timer
+def table_frame(df):
+    # Shape a frame read from PostgreSQL for the table; Service_date stays datetime64
+    df = df.reset_index(drop=True)
+    df['Service_date'] = parse_dates(df['Service_date'])
+    return df
+
+
+def date_columns(df):
+    return [column for column in df.columns if pd.api.types.is_datetime64_any_dtype(df[column])]
+
+
+def table_records(df):
+    # Rows for the browser. JSON has no date type, so datetime columns become YYYY-MM-DD
+    # text here, at the edge, and are parsed back when edits come in.
+    dates = date_columns(df)
+    if dates:
+        df = df.assign(**{column: df[column].dt.strftime('%Y-%m-%d') for column in dates})
+    return df.to_dict('records')
+
+
+def filter_frame(df, filter_query, columns):
+    # The pandas counterpart of build_where, for the same DataTable filter_query terms.
+    # columns maps column names to 'number', 'date' or 'text', as table_columns does.
+    columns = {column: columns.get(column, 'text') for column in df.columns}
+    mask = pd.Series(True, index=df.index)
+    for column, op, value, insensitive in parse_filter(filter_query, columns):
+        series = df[column]
+        if op == 'blank':
+            # Empty cells are stored as NULL on save, so they count as blank here too
+            mask &= series.isna() | series.astype('string').eq('').fillna(False)
+        elif op in ('contains', 'datestartswith'):
+            text = series.astype('string')
+            if insensitive:
+                text, value = text.str.lower(), value.lower()
+            hits = text.str.startswith(value) if op == 'datestartswith' else text.str.contains(value, regex=False)
+            mask &= hits.fillna(False).astype(bool)
+        elif value is None:
+            mask &= False
+        else:
+            if columns[column] == 'number':
+                series = pd.to_numeric(series, errors='coerce')
+            elif columns[column] == 'date':
+                series, value = pd.to_datetime(series, errors='coerce'), pd.Timestamp(value)
+            else:
+                series = series.astype('string')
+                if insensitive:
+                    series, value = series.str.lower(), value.lower()
+            mask &= COMPARISONS[op](series, value).fillna(False).astype(bool)
+    return df[mask]
+
+
+def sort_frame(df, sort_by, columns):
+    # The pandas counterpart of build_order_by; rows keep their frame order on ties
+    for sort in reversed(sort_by or []):
+        column = sort.get('column_id')
+        if column not in df.columns:
+            continue
+        if columns.get(column) == 'number':
+            key = lambda series: pd.to_numeric(series, errors='coerce')
+        elif columns.get(column) == 'date':
+            key = lambda series: pd.to_datetime(series, errors='coerce')
+        else:
+            key = lambda series: series.astype('string')
+        df = df.sort_values(column, ascending=sort.get('direction') != 'desc',
+                            na_position='last', kind='stable', key=key)
+    return df
+
+
+@frame_timer
+def page_records(df, page_current, page_size, sort_by=None, filter_query='', columns=None):
+    # Return the rows of one page (tagged with their ROW_KEY) and the number of matching rows
+    columns = columns or {}
+    view = sort_frame(filter_frame(df, filter_query, columns), sort_by, columns)
+    page = view.iloc[page_current * page_size:(page_current + 1) * page_size]
+    records = table_records(page)
+    for label, record in zip(page.index, records):
+        record[ROW_KEY] = int(label)
+    return records, len(view)
+
+
+def set_values(df, label, values):
+    for column, value in values.items():
+        if column not in df.columns:
+            df[column] = pd.Series(None, index=df.index, dtype=object)
+        elif df[column].dtype != object:
+            # Edited cells arrive as text; keep whatever the user typed, as the native table does
+            df[column] = df[column].astype(object)
+        df.at[label, column] = value
+
+
+@frame_timer
+def apply_page_edits(df, previous, current):
+    # Apply a DataTable edit (data_previous -> data, both one page) to a copy of the frame
+    dates = date_columns(df)
+    df = df.copy()
+    previous_rows = {row[ROW_KEY]: row for row in previous or [] if ROW_KEY in row}
+    current_rows = {row[ROW_KEY]: row for row in current or [] if ROW_KEY in row}
+
+    removed = [label for label in previous_rows if label not in current_rows]
+    df = df.drop(index=removed, errors='ignore')
+    for label, row in current_rows.items():
+        if label in df.index and row != previous_rows.get(label):
+            set_values(df, label, {column: value for column, value in row.items() if column != ROW_KEY})
+    for column in dates:
+        df[column] = parse_dates(df[column])
+    return df
+
+
+@frame_timer
+def append_rows(df, rows):
+    # Append new rows (a frame or a list of dicts) after the existing ones, with fresh labels
+    rows = pd.DataFrame(rows)
+    start = int(df.index.max()) + 1 if len(df) else 0
+    rows.index = pd.RangeIndex(start, start + len(rows))
+    dates = date_columns(df)
+    df = pd.concat([df, rows]) if len(df) else rows
+    for column in dates:
+        df[column] = parse_dates(df[column])
+    return df
+
+
+def pending_rows(df, updated_ids):
+    # Rows to hand to save_changes: new rows (no id yet) and rows whose id was edited
+    changed = df[df[ROW_ID].isna() | df[ROW_ID].isin(list(updated_ids))] if ROW_ID in df.columns else df
+    records = changed.to_dict('records')
+    for record in records:
+        row_id = record.get(ROW_ID)
+        record[ROW_ID] = None if row_id is None or pd.isna(row_id) else int(row_id)
+    return records
+
+
+def assign_ids(df, inserted_ids):
+    # Give the rows that had no id the ids save_changes inserted them with, in frame order
+    df = df.copy()
+    if ROW_ID not in df.columns:
+        df[ROW_ID] = pd.Series(None, index=df.index, dtype=object)
+    new_labels = df.index[df[ROW_ID].isna()]
+    df[ROW_ID] = df[ROW_ID].astype(object)
+    for label, row_id in zip(new_labels, inserted_ids):
+        df.at[label, ROW_ID] = row_id
+    return df
+
+
+@frame_timer
+def apply_saved(df, inserted_ids, versions, conflicts, current):
+    # Bring the working copy in line with a save: ids for the new rows, the new row_version
+    # of every saved row, and the database's copy (current, a frame, or None without
+    # conflicts) of each conflicting row.
+    # Conflicting rows deleted in the database are dropped; ones this session deleted but
+    # someone else changed come back. Copies of the inserted rows that the change feed
+    # patched in before the save returned are dropped, the session's own rows get the ids.
+    if ROW_ID in df.columns and len(inserted_ids):
+        df = df[~df[ROW_ID].isin(list(inserted_ids))]
+    df = assign_ids(df, inserted_ids)
+    if ROW_VERSION not in df.columns:
+        df[ROW_VERSION] = pd.Series(None, index=df.index, dtype='Int64')
+    saved = df[ROW_ID].map(versions)
+    df[ROW_VERSION] = saved.where(saved.notna(), df[ROW_VERSION])
+
+    dates = date_columns(df)
+    current_rows = {row[ROW_ID]: row for row in table_frame(current).to_dict('records')} if conflicts else {}
+    for row_id in conflicts:
+        labels = df.index[df[ROW_ID] == row_id]
+        if row_id not in current_rows:
+            df = df.drop(index=labels)
+        elif len(labels):
+            set_values(df, labels[0], current_rows.pop(row_id))
+    if current_rows:
+        df = append_rows(df, list(current_rows.values()))
+    for column in dates:
+        df[column] = parse_dates(df[column])
+    df[ROW_VERSION] = df[ROW_VERSION].astype('Int64')
+    return df
+
+
+def saved_labels(df, updated_ids, inserted_count):
+    # Frame labels of the rows a save wrote: the edited ids and the first inserted_count new
+    # rows, which save_changes inserted in frame order
+    if ROW_ID not in df.columns:
+        return list(df.index[:inserted_count])
+    new_labels = df.index[df[ROW_ID].isna()][:inserted_count]
+    return list(df.index[df[ROW_ID].isin(list(updated_ids))]) + list(new_labels)
+
+
+def edited_since(before, after, labels):
+    # Ids (in after) of the rows, given by frame label, whose values differ between two
+    # versions of the working copy; ids and row versions aside
+    labels = [label for label in labels if label in before.index and label in after.index]
+    columns = [column for column in after.columns if column not in (ROW_ID, ROW_VERSION)]
+    old = table_records(before.reindex(index=labels, columns=columns))
+    new = table_records(after.loc[labels, columns])
+    return [int(after.at[label, ROW_ID]) for label, old_row, new_row in zip(labels, old, new)
+            if json.dumps(old_row, default=str) != json.dumps(new_row, default=str)]
+
+
+@frame_timer
+def patch_rows(df, rows, deleted, pending=()):
+    # Apply a change feed event (changed rows as table records, deleted ids) to a copy of the
+    # working copy, leaving rows with unsaved changes (pending ids) alone. Returns None if
+    # nothing in the frame changed.
+    pending = set(pending)
+    ids = df[ROW_ID] if ROW_ID in df.columns else pd.Series(dtype=object)
+    labels = {row_id: label for label, row_id in ids.items() if not pd.isna(row_id)}
+    dropped = [labels[row_id] for row_id in deleted if row_id in labels and row_id not in pending]
+    changed = [row for row in rows if row[ROW_ID] in labels and row[ROW_ID] not in pending]
+    added = [row for row in rows if row[ROW_ID] not in labels and row[ROW_ID] not in pending]
+    if not (dropped or changed or added):
+        return None
+
+    dates = date_columns(df)
+    # Appended before the drop, so a new row never takes the label of a deleted one
+    df = append_rows(df, added) if added else df.copy()
+    df = df.drop(index=dropped)
+    for row in changed:
+        set_values(df, labels[row[ROW_ID]], row)
+    for column in dates:
+        df[column] = parse_dates(df[column])
+    return df
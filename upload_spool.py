@@ -0,0 +1,86 @@
+import os
+import re
+import time
+import uuid
+from urllib.parse import unquote
+
+from flask import jsonify, request
+
+from dataset_cache import SPILL_SWEEP_INTERVAL, sweep_dir
+
+
+# Workbook uploads are streamed to a spool file on the server instead of travelling through
+# the Dash callback payload as a base64 data URL. The browser posts the file in slices to
+# the upload route; each slice is copied to disk in READ_SIZE pieces, so the server never
+# holds more than one piece in memory. Callbacks only receive a small reference to the file.
+UPLOAD_DIR = os.environ.get('ZILTEK_UPLOAD_DIR', 'uploads')
+MAX_UPLOAD_BYTES = int(os.environ.get('ZILTEK_MAX_UPLOAD_MB', 200)) * 1024 * 1024
+READ_SIZE = 1024 * 1024
+ALLOWED_EXTENSIONS = ('.xlsx', '.xlsm')
+UPLOAD_ID = re.compile(r'[0-9a-f]{32}\.(?:xlsx|xlsm)')
+
+# Callbacks discard a spool file once its workbook is read. Files left by abandoned or
+# failed uploads are swept when the route is registered and then about once an hour.
+SPOOL_MAX_AGE = float(os.environ.get('ZILTEK_SPOOL_MAX_AGE_HOURS', 24)) * 3600
+
+
+def spool_path(upload_id):
+    # The id comes back from the browser, so it must look exactly like one we handed out
+    if not isinstance(upload_id, str) or not UPLOAD_ID.fullmatch(upload_id):
+        raise ValueError('Invalid upload id')
+    return os.path.join(UPLOAD_DIR, upload_id)
+
+
+def discard_upload(upload_id):
+    try:
+        os.remove(spool_path(upload_id))
+    except (FileNotFoundError, ValueError):
+        pass
+
+
+def register_upload_endpoint(server, route='/uploads'):
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+    sweep_dir(UPLOAD_DIR, SPOOL_MAX_AGE)
+    swept = [time.monotonic()]
+
+    @server.route(route, methods=['POST'])
+    def upload_chunk():
+        # First slice: no upload_id, a new spool file is created. Later slices pass the
+        # upload_id and the offset they start at, which must match what is already on disk.
+        filename = unquote(request.headers.get('X-Filename', 'workbook.xlsx'))
+        upload_id = request.args.get('upload_id')
+        offset = request.args.get('offset', 0, type=int)
+
+        if upload_id is None:
+            if time.monotonic() - swept[0] > SPILL_SWEEP_INTERVAL:
+                swept[0] = time.monotonic()
+                sweep_dir(UPLOAD_DIR, SPOOL_MAX_AGE)
+            extension = os.path.splitext(filename)[1].lower()
+            if extension not in ALLOWED_EXTENSIONS:
+                return jsonify({'error': f'Only {", ".join(ALLOWED_EXTENSIONS)} files can be uploaded'}), 400
+            upload_id = uuid.uuid4().hex + extension
+            mode = 'wb'
+        else:
+            mode = 'ab'
+
+        try:
+            path = spool_path(upload_id)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        size = os.path.getsize(path) if mode == 'ab' and os.path.exists(path) else 0
+        if mode == 'ab' and size != offset:
+            return jsonify({'error': 'Chunk offset does not match the spooled size', 'size': size}), 409
+
+        with open(path, mode) as f:
+            while True:
+                piece = request.stream.read(READ_SIZE)
+                if not piece:
+                    break
+                size += len(piece)
+                if size > MAX_UPLOAD_BYTES:
+                    f.close()
+                    discard_upload(upload_id)
+                    return jsonify({'error': 'File is too large'}), 413
+                f.write(piece)
+
+        return jsonify({'upload_id': upload_id, 'filename': filename, 'size': size})
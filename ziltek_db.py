@@ -0,0 +1,546 @@
+import io
+import re
+import csv
+import json
+import time
+import datetime
+import threading
+from functools import lru_cache
+from collections import OrderedDict
+
+import pandas as pd
+from sqlalchemy import inspect, text, bindparam, MetaData, Table, Date, DateTime, Float, Integer, Numeric
+
+from callback_metrics import frame_timer
+
+
+# SQL helpers for the ziltektable served by the CRUD dashboard.
+TABLE_NAME = 'ziltektable'
+# Number of tests per (MK_Type, year, month), kept up to date by triggers on ziltektable
+ROLLUP_TABLE = 'ziltektable_monthly_tests'
+ROW_ID = 'id'
+# Bumped by every update, so a save can tell whether a row changed since it was read
+ROW_VERSION = 'row_version'
+# Inserts of at least this many rows go through COPY instead of a multi-row INSERT
+COPY_THRESHOLD = 500
+# Index behind the per-instrument (RemScan serial) trend query
+SERIAL_DATE_INDEX = f'{TABLE_NAME}_serial_date_idx'
+# Per-serial histories are dropped by every save in this process, and after this many
+# seconds so saves made by other workers show up too
+SERIAL_HISTORY_MAX_AGE = 60
+SERIAL_HISTORY_SIZE = 256
+# Every save NOTIFYs the ids it changed on this channel, NOTIFY_BATCH ids per notification
+# to stay well under PostgreSQL's 8000 byte payload limit; see change_feed
+CHANGE_CHANNEL = f'{TABLE_NAME}_changes'
+NOTIFY_BATCH = 500
+
+FILTER_PART = re.compile(r'^\{(?P<column>[^}]+)\}\s+(?P<operator>[si]?(?:contains|datestartswith|eq|ne|le|lt|ge|gt|<=|>=|!=|=|<|>))\s+(?P<value>.+)$')
+BLANK_PART = re.compile(r'^\{(?P<column>[^}]+)\}\s+is (?P<operator>blank|nil)$')
+OPERATORS = {'eq': '=', 'ne': '!=', 'lt': '<', 'le': '<=', 'gt': '>', 'ge': '>=',
+             '=': '=', '!=': '!=', '<': '<', '<=': '<=', '>': '>', '>=': '>='}
+
+
+def quote(column):
+    return '"' + column.replace('"', '""') + '"'
+
+
+def ensure_schema(engine):
+    # Give every row a stable integer id. pandas to_sql creates the table without any key,
+    # so the id column, its sequence and its key are (re)attached when missing.
+    with engine.begin() as conn:
+        conn.execute(text(f'CREATE SEQUENCE IF NOT EXISTS {TABLE_NAME}_id_seq'))
+        conn.execute(text(f'ALTER TABLE {TABLE_NAME} ADD COLUMN IF NOT EXISTS {ROW_ID} BIGINT'))
+        conn.execute(text(f"ALTER TABLE {TABLE_NAME} ALTER COLUMN {ROW_ID} SET DEFAULT nextval('{TABLE_NAME}_id_seq')"))
+        conn.execute(text(f"SELECT setval('{TABLE_NAME}_id_seq', COALESCE((SELECT max({ROW_ID}) FROM {TABLE_NAME}), 0) + 1, false)"))
+        conn.execute(text(f"UPDATE {TABLE_NAME} SET {ROW_ID} = nextval('{TABLE_NAME}_id_seq') WHERE {ROW_ID} IS NULL"))
+        conn.execute(text(f'ALTER TABLE {TABLE_NAME} ADD COLUMN IF NOT EXISTS {ROW_VERSION} BIGINT NOT NULL DEFAULT 1'))
+        if not inspect(conn).get_pk_constraint(TABLE_NAME)['constrained_columns']:
+            conn.execute(text(f'ALTER TABLE {TABLE_NAME} ADD PRIMARY KEY ({ROW_ID})'))
+        else:
+            conn.execute(text(f'CREATE UNIQUE INDEX IF NOT EXISTS {TABLE_NAME}_id_key ON {TABLE_NAME} ({ROW_ID})'))
+        if {'RemScan_Serial', 'Service_date'} <= {column['name'] for column in inspect(conn).get_columns(TABLE_NAME)}:
+            conn.execute(text(f'CREATE INDEX IF NOT EXISTS {SERIAL_DATE_INDEX} '
+                              f'ON {TABLE_NAME} ("RemScan_Serial", "Service_date")'))
+        ensure_rollup(conn)
+    clear_table_cache()
+    clear_serial_history()
+
+
+def ensure_columns(engine, column_ids):
+    # Columns added in the DataTable are created as text columns before they are saved
+    missing = [column for column in column_ids if column not in table_columns(engine)]
+    if missing:
+        with engine.begin() as conn:
+            for column in missing:
+                conn.execute(text(f'ALTER TABLE {TABLE_NAME} ADD COLUMN IF NOT EXISTS {quote(column)} TEXT'))
+        clear_table_cache()
+
+
+@lru_cache(maxsize=4)
+def reflect_table(engine):
+    return Table(TABLE_NAME, MetaData(), autoload_with=engine)
+
+
+@lru_cache(maxsize=4)
+def table_columns(engine):
+    # Column name -> 'number', 'date' or 'text'; only these names are ever put into SQL
+    columns = {}
+    for column in reflect_table(engine).columns:
+        if isinstance(column.type, (Float, Numeric, Integer)):
+            columns[column.name] = 'number'
+        elif isinstance(column.type, (Date, DateTime)):
+            columns[column.name] = 'date'
+        else:
+            columns[column.name] = 'text'
+    return columns
+
+
+def clear_table_cache():
+    reflect_table.cache_clear()
+    table_columns.cache_clear()
+
+
+def unquote(value):
+    value = value.strip()
+    if len(value) >= 2 and value[0] == value[-1] and value[0] in '"\'`':
+        value = re.sub(r'\\(.)', r'\1', value[1:-1])
+    return value
+
+
+def escape_like(value):
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def parse_filter(filter_query, columns):
+    # Split a DataTable filter_query ("{col} op value && ...") into (column, operator, value,
+    # insensitive) terms. Comparison values are converted to the column's type, and a value
+    # that doesn't convert comes back as None (it matches no rows). Parts that don't parse
+    # or name unknown columns are skipped.
+    for part in (filter_query or '').split(' && '):
+        part = part.strip()
+        blank = BLANK_PART.match(part)
+        if blank and blank.group('column') in columns:
+            yield blank.group('column'), 'blank', None, False
+            continue
+        match = FILTER_PART.match(part)
+        if not match or match.group('column') not in columns:
+            continue
+
+        column = match.group('column')
+        column_type = columns[column]
+        operator = match.group('operator')
+        insensitive = False
+        if operator[0] in 'si' and (operator[1:] in OPERATORS or operator[1:] in ('contains', 'datestartswith')):
+            insensitive = operator[0] == 'i'
+            operator = operator[1:]
+        value = unquote(match.group('value'))
+
+        if operator not in ('contains', 'datestartswith'):
+            operator = OPERATORS[operator]
+            try:
+                if column_type == 'number':
+                    value = float(value)
+                elif column_type == 'date':
+                    value = datetime.date.fromisoformat(value)
+            except ValueError:
+                value = None
+        yield column, operator, value, insensitive
+
+
+def build_where(filter_query, columns):
+    # Translate a DataTable filter_query into a parameterised WHERE clause
+    conditions = []
+    params = {}
+    for column, operator, value, insensitive in parse_filter(filter_query, columns):
+        name = f'filter_{len(params)}'
+        if operator == 'blank':
+            conditions.append(f"{quote(column)} IS NULL")
+        elif operator in ('contains', 'datestartswith'):
+            sql_column = quote(column) if columns[column] == 'text' else f'CAST({quote(column)} AS TEXT)'
+            like = 'ILIKE' if insensitive else 'LIKE'
+            pattern = escape_like(value) + '%' if operator == 'datestartswith' else '%' + escape_like(value) + '%'
+            conditions.append(f'{sql_column} {like} :{name}')
+            params[name] = pattern
+        elif value is None:
+            conditions.append('FALSE')
+        elif insensitive and columns[column] == 'text':
+            conditions.append(f'lower({quote(column)}) {operator} lower(:{name})')
+            params[name] = value
+        else:
+            conditions.append(f'{quote(column)} {operator} :{name}')
+            params[name] = value
+
+    where = ' WHERE ' + ' AND '.join(conditions) if conditions else ''
+    return where, params
+
+
+def build_order_by(sort_by, columns):
+    # Translate a DataTable sort_by list; the row id breaks ties so OFFSET paging is stable
+    terms = []
+    for sort in sort_by or []:
+        if sort.get('column_id') in columns:
+            direction = 'DESC' if sort.get('direction') == 'desc' else 'ASC'
+            terms.append(f"{quote(sort['column_id'])} {direction} NULLS LAST")
+    terms.append(ROW_ID)
+    return ' ORDER BY ' + ', '.join(terms)
+
+
+@frame_timer
+def read_page(engine, page_current, page_size, sort_by=None, filter_query=''):
+    # Return one page of the table and the number of rows matching the filter
+    columns = table_columns(engine)
+    where, params = build_where(filter_query, columns)
+    order_by = build_order_by(sort_by, columns)
+    with engine.connect() as conn:
+        total = conn.execute(text(f'SELECT count(*) FROM {TABLE_NAME}{where}'), params).scalar()
+        page_params = dict(params, limit=page_size, offset=page_current * page_size)
+        df = pd.read_sql(text(f'SELECT * FROM {TABLE_NAME}{where}{order_by} LIMIT :limit OFFSET :offset'),
+                         conn, params=page_params)
+    return df, total
+
+
+def clean_value(value):
+    # Empty cells from the DataTable and NaN/NaT from pandas are stored as NULL
+    if isinstance(value, str):
+        return None if value == '' else value
+    if value is not None and pd.isna(value):
+        return None
+    return value
+
+
+def lock_versions(conn, ids):
+    # Current row_version of the given rows, locked until the end of the transaction
+    if not ids:
+        return {}
+    result = conn.execute(text(f'SELECT {ROW_ID}, {ROW_VERSION} FROM {TABLE_NAME} '
+                               f'WHERE {ROW_ID} = ANY(:ids) ORDER BY {ROW_ID} FOR UPDATE'),
+                          {'ids': [int(row_id) for row_id in ids]})
+    return dict(result.all())
+
+
+def expected_version(value):
+    return None if value is None or pd.isna(value) else int(value)
+
+
+def save_changes(engine, rows, updated_ids=(), deleted_ids=(), deleted_versions=None):
+    # Apply only what changed in the browser, in one transaction: rows without an id are
+    # inserted, rows whose id was edited are updated and removed ids are deleted.
+    # Edited rows carry the row_version they were read with, and deleted_versions maps
+    # deleted ids to theirs. A row that has been changed (or, for an edit, deleted) by
+    # someone else since then is a conflict: it is left as it is in the database and the
+    # rest of the save goes ahead. Returns the ids given to the inserted rows in the order
+    # the rows were passed, the new row_version of every inserted and updated row, and the
+    # ids of the conflicting rows.
+    table = reflect_table(engine)
+    columns = [column.name for column in table.columns if column.name not in (ROW_ID, ROW_VERSION)]
+    updated_ids = set(updated_ids)
+    deleted_versions = deleted_versions or {}
+
+    inserts = []
+    updates = []
+    expected = {}
+    for row in rows:
+        values = {column: clean_value(row.get(column)) for column in columns}
+        if row.get(ROW_ID) is None:
+            inserts.append(values)
+        elif row[ROW_ID] in updated_ids:
+            # Bind parameters are numbered because user-added column names can contain spaces
+            updates.append(dict({f'c{i}': values[column] for i, column in enumerate(columns)}, row_id=row[ROW_ID]))
+            expected[row[ROW_ID]] = expected_version(row.get(ROW_VERSION))
+
+    inserted_ids = []
+    with engine.begin() as conn:
+        current = lock_versions(conn, set(expected) | set(deleted_ids))
+        conflicts = {row_id for row_id, version in expected.items()
+                     if row_id not in current or version not in (None, current[row_id])}
+        conflicts |= {row_id for row_id in deleted_ids
+                      if row_id in current and expected_version(deleted_versions.get(row_id)) not in (None, current[row_id])}
+        updates = [update for update in updates if update['row_id'] not in conflicts]
+        deleted_ids = [row_id for row_id in deleted_ids if row_id not in conflicts]
+        saved_ids = {update['row_id'] for update in updates}
+
+        if deleted_ids:
+            conn.execute(table.delete().where(table.c[ROW_ID].in_(list(deleted_ids))))
+        if updates:
+            statement = table.update().where(table.c[ROW_ID] == bindparam('row_id')).values(
+                {column: bindparam(f'c{i}') for i, column in enumerate(columns)})
+            conn.execute(statement.values({ROW_VERSION: table.c[ROW_VERSION] + 1}), updates)
+        if len(inserts) >= COPY_THRESHOLD:
+            inserted_ids = copy_rows(conn, columns, record_chunks(inserts, columns))
+        elif inserts:
+            result = conn.execute(table.insert().returning(table.c[ROW_ID], sort_by_parameter_order=True), inserts)
+            inserted_ids = [row_id for row_id, in result]
+        notify_changes(conn, sorted(saved_ids) + inserted_ids, deleted_ids)
+    clear_serial_history()
+
+    # Inserted rows start at the column default of 1
+    versions = {row_id: current[row_id] + 1 for row_id in saved_ids}
+    versions.update({row_id: 1 for row_id in inserted_ids})
+    return inserted_ids, versions, sorted(conflicts)
+
+
+def notify_changes(conn, changed_ids, deleted_ids=()):
+    # Queue notifications of the changed (inserted or updated) and deleted ids; PostgreSQL
+    # only delivers them to listeners once the transaction commits
+    changed = [('ids', int(row_id)) for row_id in changed_ids] + [('deleted', int(row_id)) for row_id in deleted_ids]
+    for start in range(0, len(changed), NOTIFY_BATCH):
+        payload = {'ids': [], 'deleted': []}
+        for key, row_id in changed[start:start + NOTIFY_BATCH]:
+            payload[key].append(row_id)
+        conn.execute(text('SELECT pg_notify(:channel, :payload)'),
+                     {'channel': CHANGE_CHANNEL, 'payload': json.dumps(payload)})
+
+
+def read_rows(engine, ids):
+    # The rows with the given ids as they are in the database now
+    with engine.connect() as conn:
+        return pd.read_sql(text(f'SELECT * FROM {TABLE_NAME} WHERE {ROW_ID} = ANY(:ids) ORDER BY {ROW_ID}'),
+                           conn, params={'ids': [int(row_id) for row_id in ids]})
+
+
+class CsvStream:
+    # File-like object for copy_expert that pulls CSV text from an iterator of chunks as
+    # PostgreSQL reads, so a large upload is never held as one big string
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.buffer = ''
+
+    def read(self, size=-1):
+        while size < 0 or len(self.buffer) < size:
+            chunk = next(self.chunks, None)
+            if chunk is None:
+                break
+            self.buffer += chunk
+        if size < 0:
+            size = len(self.buffer)
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+
+def record_chunks(rows, columns, chunk_rows=1000):
+    # CSV text for row dicts, chunk_rows rows at a time; None is written as an empty field (NULL)
+    rows = iter(rows)
+    while True:
+        chunk = io.StringIO()
+        writer = csv.writer(chunk, lineterminator='\n')
+        for _, row in zip(range(chunk_rows), rows):
+            writer.writerow(['' if row.get(column) is None else row.get(column) for column in columns])
+        if not chunk.getvalue():
+            return
+        yield chunk.getvalue()
+
+
+def copy_rows(conn, columns, chunks):
+    # Bulk insert new rows: CSV chunks are loaded with COPY FROM STDIN into a staging table
+    # and moved into the table with one INSERT, taking their ids from the sequence in COPY
+    # order. Only inserts go this way; updates need the row_version check in save_changes.
+    # Returns the new ids in order.
+    conn.execute(text(f'CREATE TEMP TABLE {TABLE_NAME}_staging (LIKE {TABLE_NAME} INCLUDING DEFAULTS) ON COMMIT DROP'))
+    conn.execute(text(f'ALTER TABLE {TABLE_NAME}_staging ADD COLUMN copy_row BIGSERIAL'))
+
+    cursor = conn.connection.cursor()
+    try:
+        cursor.copy_expert(f"COPY {TABLE_NAME}_staging ({', '.join(quote(column) for column in columns)}) "
+                           f"FROM STDIN WITH (FORMAT csv, NULL '')", CsvStream(chunks))
+    finally:
+        cursor.close()
+
+    column_list = ', '.join(quote(column) for column in columns)
+    conn.execute(text(f'INSERT INTO {TABLE_NAME} ({ROW_ID}, {column_list}) '
+                      f'SELECT {ROW_ID}, {column_list} FROM {TABLE_NAME}_staging ORDER BY copy_row'))
+    result = conn.execute(text(f'SELECT {ROW_ID} FROM {TABLE_NAME}_staging ORDER BY copy_row'))
+    return [row_id for row_id, in result]
+
+
+# Upsert of the count changes of one statement, from the rows it removed (-1) and added
+# (+1). The upsert locks each group's row, in key order, so concurrent saves to the same
+# month add up instead of overwriting each other.
+ROLLUP_COUNT = f'''
+            INSERT INTO {ROLLUP_TABLE} AS r ("MK_Type", year, month, tests)
+            SELECT "MK_Type", EXTRACT(YEAR FROM "Service_date")::INT, EXTRACT(MONTH FROM "Service_date")::INT, sum(delta)
+            FROM ({{changes}}) AS changes
+            WHERE "MK_Type" IS NOT NULL AND "Service_date" IS NOT NULL
+            GROUP BY 1, 2, 3
+            HAVING sum(delta) <> 0
+            ORDER BY 1, 2, 3
+            ON CONFLICT ("MK_Type", year, month) DO UPDATE SET tests = r.tests + EXCLUDED.tests;'''
+REMOVED = 'SELECT "MK_Type", "Service_date", -1 AS delta FROM old_rows'
+ADDED = 'SELECT "MK_Type", "Service_date", 1 AS delta FROM new_rows'
+# Statement-level trigger function. Each event has its own transition tables, and a
+# statement may only name the ones its event has, hence a branch per event. Groups left
+# with no tests are removed afterwards.
+ROLLUP_FUNCTION = f'''
+    CREATE OR REPLACE FUNCTION {ROLLUP_TABLE}_count() RETURNS trigger LANGUAGE plpgsql AS $$
+    BEGIN
+        IF TG_OP = 'TRUNCATE' THEN
+            DELETE FROM {ROLLUP_TABLE};
+        ELSIF TG_OP = 'INSERT' THEN{ROLLUP_COUNT.format(changes=ADDED)}
+        ELSIF TG_OP = 'DELETE' THEN{ROLLUP_COUNT.format(changes=REMOVED)}
+        ELSE{ROLLUP_COUNT.format(changes=f'{REMOVED} UNION ALL {ADDED}')}
+        END IF;
+        DELETE FROM {ROLLUP_TABLE} WHERE tests <= 0;
+        RETURN NULL;
+    END
+    $$'''
+ROLLUP_TRIGGERS = {
+    'insert': f'AFTER INSERT ON {TABLE_NAME} REFERENCING NEW TABLE AS new_rows',
+    'update': f'AFTER UPDATE ON {TABLE_NAME} REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows',
+    'delete': f'AFTER DELETE ON {TABLE_NAME} REFERENCING OLD TABLE AS old_rows',
+    'truncate': f'AFTER TRUNCATE ON {TABLE_NAME}',
+}
+
+
+def ensure_rollup(conn):
+    # Create the rollup table and the triggers that keep it up to date. Every statement
+    # that writes ziltektable (saves here, the older apps, manual SQL) adds its rows to and
+    # takes its old rows from their groups' counts, in its own transaction. The triggers
+    # go with the table when pandas to_sql replaces it, so if they are missing the rollup
+    # is rebuilt from the table before they are created again.
+    conn.execute(text(f'''
+        CREATE TABLE IF NOT EXISTS {ROLLUP_TABLE} (
+            "MK_Type" TEXT NOT NULL,
+            year INT NOT NULL,
+            month INT NOT NULL,
+            tests BIGINT NOT NULL,
+            PRIMARY KEY ("MK_Type", year, month)
+        )'''))
+    # Keeps writes out until the triggers exist, and other workers starting up waiting
+    conn.execute(text(f'LOCK TABLE {TABLE_NAME} IN SHARE ROW EXCLUSIVE MODE'))
+    triggers = conn.execute(text('SELECT count(*) FROM pg_trigger WHERE tgrelid = CAST(:table AS regclass) '
+                                 'AND tgname LIKE :prefix'),
+                            {'table': TABLE_NAME, 'prefix': f'{ROLLUP_TABLE}_%'}).scalar()
+    if triggers == len(ROLLUP_TRIGGERS):
+        return
+    conn.execute(text(f'DELETE FROM {ROLLUP_TABLE}'))
+    conn.execute(text(f'''
+        INSERT INTO {ROLLUP_TABLE} ("MK_Type", year, month, tests)
+        SELECT "MK_Type", EXTRACT(YEAR FROM "Service_date")::INT, EXTRACT(MONTH FROM "Service_date")::INT, count(*)
+        FROM {TABLE_NAME}
+        WHERE "MK_Type" IS NOT NULL AND "Service_date" IS NOT NULL
+        GROUP BY 1, 2, 3'''))
+    conn.execute(text(ROLLUP_FUNCTION))
+    for name, trigger in ROLLUP_TRIGGERS.items():
+        conn.execute(text(f'DROP TRIGGER IF EXISTS {ROLLUP_TABLE}_{name} ON {TABLE_NAME}'))
+        conn.execute(text(f'CREATE TRIGGER {ROLLUP_TABLE}_{name} {trigger} '
+                          f'FOR EACH STATEMENT EXECUTE FUNCTION {ROLLUP_TABLE}_count()'))
+
+
+def yearly_test_counts(engine):
+    # The rollup table is created by ensure_schema
+    with engine.connect() as conn:
+        return pd.read_sql(text(f'SELECT year AS "Year", sum(tests)::BIGINT AS tests FROM {ROLLUP_TABLE} '
+                                f'GROUP BY year ORDER BY year'), conn)
+
+
+def monthly_test_counts(engine, year):
+    with engine.connect() as conn:
+        return pd.read_sql(text(f'SELECT month AS "Month", sum(tests)::BIGINT AS tests FROM {ROLLUP_TABLE} '
+                                f'WHERE year = :year GROUP BY month ORDER BY month'), conn, params={'year': int(year)})
+
+
+serial_histories = OrderedDict()
+serial_histories_lock = threading.Lock()
+
+
+def serial_history(engine, serial):
+    # Every saved test of one instrument in date order, read through the (RemScan_Serial,
+    # Service_date) index and kept per serial (LRU) so repeated clicks don't hit the database
+    now = time.monotonic()
+    with serial_histories_lock:
+        cached = serial_histories.get(serial)
+        if cached is not None and now - cached[0] < SERIAL_HISTORY_MAX_AGE:
+            serial_histories.move_to_end(serial)
+            return cached[1]
+
+    with engine.connect() as conn:
+        df = pd.read_sql(text(f'SELECT * FROM {TABLE_NAME} WHERE "RemScan_Serial" = :serial '
+                              f'ORDER BY "Service_date" NULLS LAST, {ROW_ID}'), conn, params={'serial': serial})
+    df['Service_date'] = pd.to_datetime(df['Service_date'])
+
+    with serial_histories_lock:
+        serial_histories[serial] = (now, df)
+        serial_histories.move_to_end(serial)
+        while len(serial_histories) > SERIAL_HISTORY_SIZE:
+            serial_histories.popitem(last=False)
+    return df
+
+
+def clear_serial_history():
+    with serial_histories_lock:
+        serial_histories.clear()
+
+
+def column_histogram(engine, column, bins, log=False, mk_types=('mk1', 'mk2')):
+    # Histogram of a numeric column per MK type, binned in PostgreSQL with width_bucket.
+    # With log the bins are evenly spaced in log10 of the (positive) values. Returns the
+    # edges and a count array per MK type, or None if the column has no values.
+    if table_columns(engine).get(column) != 'number':
+        return None
+    value = f'log({quote(column)})' if log else quote(column)
+    # NaN sorts above every number, so it would become the top bin edge and width_bucket
+    # refuses NaN bounds
+    where = f'lower("MK_Type") = ANY(:mk_types) AND {quote(column)} IS NOT NULL AND {quote(column)} <> \'NaN\''
+    if log:
+        where += f' AND {quote(column)} > 0'
+    params = {'mk_types': list(mk_types)}
+
+    with engine.connect() as conn:
+        low, high = conn.execute(text(f'SELECT min({value}), max({value}) FROM {TABLE_NAME} WHERE {where}'),
+                                 params).one()
+        if low is None:
+            return None
+        if low == high:
+            # Same range NumPy uses for a single distinct value
+            low, high = low - 0.5, high + 0.5
+        # The maximum lands in bucket bins + 1, so it is folded into the last bin
+        result = conn.execute(text(f'''
+            SELECT lower("MK_Type"),
+                   LEAST(width_bucket({value}, CAST(:low AS DOUBLE PRECISION), CAST(:high AS DOUBLE PRECISION), :bins), :bins),
+                   count(*)
+            FROM {TABLE_NAME} WHERE {where}
+            GROUP BY 1, 2'''), dict(params, low=float(low), high=float(high), bins=bins))
+        counts = {mk_type: [0] * bins for mk_type in mk_types}
+        for mk_type, bucket, count in result:
+            counts[mk_type][bucket - 1] += count
+
+    step = (float(high) - float(low)) / bins
+    edges = [float(low) + step * i for i in range(bins + 1)]
+    return edges, counts
+
+
+def column_box_stats(engine, column, mk_type, max_outliers):
+    # Box statistics of a numeric column for one MK type, computed in PostgreSQL with
+    # percentile_cont; the same fields as chart_stats.box_stats, or None if there are no values
+    if table_columns(engine).get(column) != 'number':
+        return None
+    value = quote(column)
+    where = f'"MK_Type" = :mk_type AND {value} IS NOT NULL AND {value} <> \'NaN\''
+    params = {'mk_type': mk_type}
+    with engine.connect() as conn:
+        count, q1, median, q3, mean = conn.execute(text(f'''
+            SELECT count(*),
+                   percentile_cont(0.25) WITHIN GROUP (ORDER BY {value}),
+                   percentile_cont(0.5) WITHIN GROUP (ORDER BY {value}),
+                   percentile_cont(0.75) WITHIN GROUP (ORDER BY {value}),
+                   avg({value})
+            FROM {TABLE_NAME} WHERE {where}'''), params).one()
+        if not count:
+            return None
+        params.update(low=q1 - 1.5 * (q3 - q1), high=q3 + 1.5 * (q3 - q1), median=median, limit=max_outliers)
+        lowerfence, upperfence = conn.execute(text(f'''
+            SELECT min({value}), max({value}) FROM {TABLE_NAME}
+            WHERE {where} AND {value} BETWEEN :low AND :high'''), params).one()
+        outliers = [outlier for outlier, in conn.execute(text(f'''
+            SELECT {value} FROM {TABLE_NAME}
+            WHERE {where} AND ({value} < :low OR {value} > :high)
+            ORDER BY abs({value} - :median) DESC LIMIT :limit'''), params)]
+    return {
+        'count': count,
+        'q1': q1,
+        'median': median,
+        'q3': q3,
+        'lowerfence': lowerfence,
+        'upperfence': upperfence,
+        'mean': mean,
+        'outliers': sorted(outliers),
+    }